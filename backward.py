@@ -0,0 +1,67 @@
+import sys
+import time
+import heapq
+import sympy
+
+from bitmap import VerifiedBitmap
+
+
+# Search the strong C_coeff tree backwards from 1.
+#
+# The predecessors of x are p*x for every prime p < coeff (stripping p*x lands
+# where stripping x does), and (x-1)/coeff when that is an integer with no prime
+# factor below coeff (the only kind of integer that takes the coeff*y + 1 step).
+# Everything reached provably reduces to 1, without iterating forward.
+#
+# Intermediate values are kept to at most bound, so an integer <= max whose
+# trajectory climbs above bound will not be reached and shows up as a hole.
+def backward_search(coeff, max, bound=None, bitmap_path=None):
+
+    if bound is None:
+        bound = max
+
+    primes = list(sympy.sieve.primerange(coeff))
+
+    reached = VerifiedBitmap(bound + 1, bitmap_path)
+    reached.add(1)
+
+    # always expand the smallest integer first, keeping the frontier low
+    frontier = [1]
+    while frontier:
+        x = heapq.heappop(frontier)
+
+        for p in primes:
+            y = p * x
+            if y > bound:
+                break
+            if y not in reached:
+                reached.add(y)
+                heapq.heappush(frontier, y)
+
+        if (x - 1) % coeff == 0:
+            y = (x - 1) // coeff
+            if y > 1 and y not in reached and all(y % p != 0 for p in primes):
+                reached.add(y)
+                heapq.heappush(frontier, y)
+
+    return reached
+
+
+# The integers in [1, max] the search did not reach, in one pass over the bitmap
+def holes(reached, max):
+    return [n for n in range(1, max + 1) if n not in reached]
+
+
+if __name__ == "__main__":
+
+    COEFFICIENT = int(sys.argv[1])
+    MAX = int(sys.argv[2])
+    BOUND = int(sys.argv[3]) if len(sys.argv) > 3 else 8 * MAX
+
+    t1 = time.time()
+    reached = backward_search(COEFFICIENT, MAX, BOUND)
+    missing = holes(reached, MAX)
+
+    print(f'[C_{COEFFICIENT}] {MAX - len(missing)} of the integers up to {MAX} provably reach 1 (intermediates bounded by {BOUND})')
+    print(f'[C_{COEFFICIENT}] {len(missing)} holes, the first few: {missing[:20]}')
+    print(f'[C_{COEFFICIENT}] took {time.time() - t1} seconds.')
@@ -0,0 +1,290 @@
+import sys
+import os
+import io
+import json
+import time
+import random
+import platform
+import contextlib
+import numpy as np
+from numba import uint64
+
+import cuda
+import jump
+import cycles
+import supermin
+import lockstep
+import primality
+import test_25_cpu
+import cpu_test_min
+import binary_reductions
+from strip import strip_table
+from registry import kernel_step
+
+
+# Reduction throughput for every engine in the repo, over a matrix of coefficients
+# and input sizes. A step is one step of the strong map as the kernels take it
+# (a strip, or a coeff*n + 1), counted once per input by a reference walk outside
+# the timed region, so steps/sec means the same thing for every engine.
+#
+#   python benchmark.py --save          write the results as the new baseline
+#   python benchmark.py                 run and compare against the baseline
+
+BASELINE_PATH = 'benchmark.baseline.json'
+
+COEFFICIENTS = [3, 5, 7, 25, 33, 127]
+
+# how many inputs each size draws, see inputs()
+SIZES = {
+    'serial': 2000,
+    '2^48-2^50': 200,
+    '2048-bit': 4,
+}
+
+# every run uses the same inputs, so results are comparable across runs
+SEED = 1
+
+# each cell is timed this many times and the fastest kept
+REPEAT = 3
+
+# how much slower than the baseline a cell has to be to count as a regression
+REGRESSION_THRESHOLD = 0.2
+
+# inputs whose reference walk doesn't reach 1 inside these are dropped, so every
+# engine in a cell reduces the same converging inputs
+STEP_LIMIT = 200000
+BIT_LIMIT = 10000
+
+# the 64-bit engines only get the inputs that stay under their divergence cap
+U64_PEAK_LIMIT = int(cuda.DIVERGENCE_CAP)
+
+
+def inputs(size, coeff):
+    count = SIZES[size]
+    rng = random.Random(f'{SEED}-{size}-{coeff}')
+    if size == 'serial':
+        return list(range(1, count + 1))
+    if size == '2^48-2^50':
+        return [rng.randint(2**48, 2**50 - 1) for i in range(count)]
+    return [rng.randint(2**2047, 2**2048 - 1) for i in range(count)]
+
+
+# steps to reach 1 and the largest value on the way, or None if n doesn't get
+# there within the limits
+def reference(coeff, n):
+    steps = 0
+    peak = n
+    while n != 1:
+        n = kernel_step(coeff, n)
+        steps += 1
+        peak = max(peak, n)
+        if steps > STEP_LIMIT or n.bit_length() > BIT_LIMIT:
+            return None
+    return steps, peak
+
+
+def quiet(f, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return f(*args)
+
+
+def run_cuda_collatz(coeff, nums):
+    for n in nums:
+        quiet(cuda._collatz, coeff, n)
+
+
+def run_test_25_cpu(coeff, nums):
+    for n in nums:
+        quiet(test_25_cpu._collatz, coeff, n)
+
+
+def run_test_25_cpu_python(coeff, nums):
+    for n in nums:
+        quiet(test_25_cpu._collatz, coeff, n, None, cycles.DEFAULT_DETECTOR, None, 'python')
+
+
+def run_cpu_test_min(coeff, nums):
+    for n in nums:
+        cpu_test_min._collatz(coeff, n)
+
+
+def run_supermin(coeff, nums):
+    for n in nums:
+        supermin._reduce(coeff, n)
+
+
+def run_binary_reductions(coeff, nums):
+    for n in nums:
+        binary_reductions.reduce(n)
+
+
+def run_primality(coeff, nums):
+    for n in nums:
+        primality.reduce(n, primality.reduce_func_collatz)
+
+
+def run_lockstep(coeff, nums):
+    lockstep.collatz_lockstep(np.array(nums, dtype=np.uint64), coeff, stop_on_failure=False)
+
+
+def run_numba_cpu(coeff, nums):
+    n_arr = np.array(nums, dtype=np.uint64)
+    results = np.zeros(n_arr.size, dtype=np.uint8)
+    hits = np.zeros(n_arr.size, dtype=np.uint64)
+    empty = np.zeros(0, dtype=np.uint64)
+    values = np.zeros(n_arr.size, dtype=np.uint64)
+    steps = np.zeros(n_arr.size, dtype=np.uint64)
+    peaks = np.zeros(n_arr.size, dtype=np.uint64)
+    status_flag = np.zeros(1, dtype=np.int64)
+    cuda.collatz_cpu(n_arr, uint64(coeff), cuda.DIVERGENCE_CAP, results, status_flag, strip_table(coeff), False, uint64(0), empty, empty, hits, values, steps, peaks)
+
+
+def run_jump(coeff, nums):
+    n_arr = np.array(nums, dtype=np.uint64)
+    results = np.zeros(n_arr.size, dtype=np.uint64)
+    steps = np.zeros(n_arr.size, dtype=np.uint64)
+    jump.collatz_jump_cpu(n_arr, jump.jump_arrays(coeff), results, steps, False)
+
+
+# name: (run, which coefficients it reduces (None for all), 64-bit only, compiled)
+#
+# The _collatz engines run on the default big integer engine (gmpy2 when it is
+# installed), the python entry pins Python ints to compare against.
+#
+# binary_reductions, primality (with reduce_func_collatz) and the jump tables only
+# know the classic map, which is the strong map for C_3 alone.
+ENGINES = {
+    'cuda._collatz': (run_cuda_collatz, None, False, False),
+    'test_25_cpu._collatz': (run_test_25_cpu, None, False, False),
+    'test_25_cpu._collatz python': (run_test_25_cpu_python, None, False, False),
+    'cpu_test_min._collatz': (run_cpu_test_min, None, False, False),
+    'supermin._reduce': (run_supermin, None, False, False),
+    'binary_reductions.reduce': (run_binary_reductions, [3], False, False),
+    'primality.reduce': (run_primality, [3], False, False),
+    'lockstep': (run_lockstep, None, True, False),
+    'numba cpu': (run_numba_cpu, None, True, True),
+    'jump': (run_jump, [3], True, True),
+}
+
+
+def time_cell(run, coeff, nums, repeat=REPEAT):
+    best = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        run(coeff, nums)
+        elapsed = time.perf_counter() - t1
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(engines=None, coeffs=COEFFICIENTS, sizes=SIZES, repeat=REPEAT):
+
+    results = {}
+
+    for coeff in coeffs:
+        for size in sizes:
+            walks = [(n, reference(coeff, n)) for n in inputs(size, coeff)]
+            converging = [(n, walk) for n, walk in walks if walk is not None]
+            if len(converging) < len(walks):
+                print(f'[C_{coeff}] {size}: {len(walks) - len(converging)} of {len(walks)} inputs dropped, they do not reach 1 within the limits')
+
+            for name, (run, only, u64, compiled) in ENGINES.items():
+                if engines is not None and name not in engines:
+                    continue
+                if only is not None and coeff not in only:
+                    continue
+
+                cell = [(n, walk) for n, walk in converging if not u64 or walk[1] < U64_PEAK_LIMIT]
+                if not cell:
+                    continue
+
+                nums = [n for n, _ in cell]
+                steps = sum(walk[0] for _, walk in cell)
+
+                # compile outside the timed region
+                if compiled:
+                    run(coeff, nums[:1])
+
+                elapsed = time_cell(run, coeff, nums, repeat)
+                key = f'{name}/C_{coeff}/{size}'
+                results[key] = {
+                    'integers': len(nums),
+                    'steps': steps,
+                    'seconds': elapsed,
+                    'integers_per_sec': len(nums) / elapsed,
+                    'steps_per_sec': steps / elapsed,
+                }
+                print(f'{key:<48} {len(nums) / elapsed:>14.1f} int/s {steps / elapsed:>16.1f} steps/s')
+
+    return results
+
+
+def save(results, path=BASELINE_PATH):
+    state = {
+        'machine': platform.platform(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=1)
+
+
+def load(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+# steps/sec against the baseline, per cell. A ratio above 1 is faster.
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    print(f'Compared to the baseline from {baseline["time"]} ({baseline["machine"]})')
+
+    regressions = []
+    for key, cell in results.items():
+        old = baseline['results'].get(key)
+        if old is None:
+            print(f'{key:<48} {"new":>10}')
+            continue
+        ratio = cell['steps_per_sec'] / old['steps_per_sec']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  <-- slower'
+            regressions.append(key)
+        elif ratio > 1 + threshold:
+            flag = '  faster'
+        print(f'{key:<48} {ratio:>9.2f}x{flag}')
+
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark every reduction engine.')
+    parser.add_argument('--engine', action='append', choices=list(ENGINES),
+        help='Only run this engine (can be given more than once).')
+    parser.add_argument('--coefficient', type=int, action='append',
+        help='Only run this coefficient (can be given more than once).')
+    parser.add_argument('--size', action='append', choices=list(SIZES),
+        help='Only run this input size (can be given more than once).')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true',
+        help='Store the results as the new baseline instead of comparing.')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+        help='How much slower a cell has to be to count as a regression.')
+    args = parser.parse_args()
+
+    results = benchmark(args.engine, args.coefficient or COEFFICIENTS, args.size or list(SIZES), args.repeat)
+
+    if args.save:
+        save(results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        regressions = compare(results, load(args.baseline), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} cells regressed')
+            sys.exit(1)
+    else:
+        print(f'No baseline at {args.baseline}, rerun with --save to make one.')
@@ -6,18 +6,29 @@ import math
 import mpmath
 import pdb
 import pprint
+import heapq
+import numpy as np
+import jump
+from bitmap import VerifiedBitmap
+from parity import ParityVector
 
 reductions = 0
 
+# how many integers get_patterns pushes through NumPy at once
+PATTERN_CHUNK = 2**22
+
 def bin_to_frac(b):
     rval = 0
 
+    if isinstance(b, str):
+        b = ParityVector.from_string(b)
+
     x = sympy.Symbol('x')
     p = sympy.Poly(x)
 
     for c in b:
         p *= 2
-        if c == '1':
+        if c == 1:
             p -= 1
 
     p /= x
@@ -29,16 +40,16 @@ def bin_to_frac(b):
     return sols[0]
 
 def frac_to_bin(n,d):
-    s = ''
+    s = ParityVector()
     assert d > n
     x = n
     while True:
         x *= 2
         if x > d:
-            s += '1'
+            s.append(1)
             x -= d
         else:
-            s += '0'
+            s.append(0)
 
         if x == n:
             return s
@@ -48,8 +59,8 @@ def f_1(x): return x/2
 
 def g_1(x): return (3*x+1)/2
 def g(x):
-    if (x-1) % 3 == 0:
-        return int((x-1) / 3)
+    if (2*x-1) % 3 == 0:
+        return (2*x-1) // 3
     else:
         return None
 
@@ -60,40 +71,46 @@ def first_missing(_list, start=1):
             return i
     return None
 
+# jump bits mark the odd steps, parity vectors mark the halvings ('1' for f_1, '0' for g_1)
+def jump_parity(bits, k):
+    return ParityVector(bits ^ ((1 << k) - 1), k)
+
 def reduce(x):
-    rval = ''
+    rval = ParityVector()
+    table = jump.jump_table(3)
 
-    n = x
+    n = int(x)
     while n != 1:
-        if n % 2 == 0:
-            n = f_1(n)
-            rval += '1'
-        else:
-            n = g_1(n)
-            rval += '0'
+        n, k, _, bits = jump.advance(n, table)
+        rval += jump_parity(bits, k)
 
     return rval
 
+# walks the tree backwards from 1, smallest integer first. reached marks every
+# integer as it is queued so nothing is visited twice; with no max it runs until
+# interrupted.
 def generate(max=None):
     rval = {}
-    todo = [(1,'')]
+    todo = [(1, ParityVector())]
+    reached = VerifiedBitmap(max) if max is not None else set()
+    reached.add(1)
 
     print('Generating table...')
 
     try:
         while len(todo) > 0:
 
-            x, parity_string = todo.pop()
+            x, parity_string = heapq.heappop(todo)
+            rval[x] = parity_string
 
             x1, x2 = f(x), g(x)
 
-            if x1 and (max is None or x1 < max): todo.append((x1, parity_string+'1'))
-            if x2 and x2 > 1 and (max is None or x2 < max): todo.append((x2, parity_string+'0'))
-
-            rval[x] = parity_string
-
-            todo = sorted(todo, key=lambda x:x[0])
-            todo.reverse()
+            if (max is None or x1 < max) and x1 not in reached:
+                reached.add(x1)
+                heapq.heappush(todo, (x1, parity_string.with_bit(1)))
+            if x2 and x2 > 1 and (max is None or x2 < max) and x2 not in reached:
+                reached.add(x2)
+                heapq.heappush(todo, (x2, parity_string.with_bit(0)))
 
     except KeyboardInterrupt:
         pass
@@ -101,14 +118,22 @@ def generate(max=None):
     print('Filling holes...')
 
     for k in rval.keys():
-        rval[k] = rval[k][::-1]
-
-    x = 1
-    while True:
-        x = first_missing(rval.keys(), start=x)
-        if x is None:
-            break
-        rval[x] = reduce(x)
+        rval[k] = rval[k].reverse()
+
+    # a hole's trajectory climbed past max, so walk it forward only until it lands
+    # on an integer that already has its string
+    for x in range(1, max if max is not None else len(rval)):
+        if x not in rval:
+            n = x
+            prefix = ParityVector()
+            while n not in rval:
+                if n % 2 == 0:
+                    n = n // 2
+                    prefix.append(1)
+                else:
+                    n = (3 * n + 1) // 2
+                    prefix.append(0)
+            rval[x] = prefix + rval[n]
 
     return rval
 
@@ -116,6 +141,8 @@ def invert_frac(n,d):
     return sympy.numbers.igcdex(n,d)[0] % d
 
 def rotate(l, n):
+    if isinstance(l, ParityVector):
+        return l.rotate(n)
     n = n % len(l)
     return l[n:] + l[:n]
 
@@ -131,7 +158,7 @@ def print_tree(tree):
     print('\n')
     for i in range(len(tree)):
         log = height-i-2
-        fmt = ' '*int((2**log)) + (' '*int(2**(log+1)-1)).join(c for c in tree[i])
+        fmt = ' '*int((2**log)) + (' '*int(2**(log+1)-1)).join(str(c) for c in tree[i])
         print(fmt)
     print('\n')
 
@@ -148,15 +175,15 @@ def generate_and_inspect():
     for column in range(10):
 
         # gather the patter
-        pattern = ''
+        pattern = ParityVector()
         pattern_length = 2**(column+1)
         i = 0
 
         while True:
             if len(table[i]) < column+1:
-                pattern = ''
+                pattern = ParityVector()
             else:
-                pattern += table[i][column]
+                pattern.append(table[i][column])
 
             if len(pattern) == pattern_length:
                 break
@@ -183,21 +210,44 @@ def generate_and_inspect():
     return
 
 def reduce_to_i(x, i):
-    rval = ''
+    rval = ParityVector()
+    table = jump.jump_table(3)
 
-    n = x
+    n = int(x)
     while n != 1 and len(rval) != i:
-        if n % 2 == 0:
-            n = f_1(n)
-            rval += '1'
+        if i - len(rval) >= table.k:
+            n, k, _, bits = jump.advance(n, table)
+            rval += jump_parity(bits, k)
+        elif n % 2 == 0:
+            n = n // 2
+            rval.append(1)
         else:
-            n = g_1(n)
-            rval += '0'
+            n = (3 * n + 1) // 2
+            rval.append(0)
 
     return rval
 
 def invert_bin(b):
-    return ''.join(['1' if c == '0' else '0' for c in b])
+    if isinstance(b, str):
+        b = ParityVector.from_string(b)
+    return b.invert()
+
+# column i of the table for the integers [2**(i+1), 2**(i+2)): whether step i halves.
+# Step i only depends on the integer mod 2**(i+1), and nothing in that range reaches 1
+# within i steps, so the whole column is i vectorized steps over a range.
+def column_pattern(i):
+    start = 2**(i+1)
+    chunks = []
+
+    for lo in range(start, 2*start, PATTERN_CHUNK):
+        n = np.arange(lo, min(lo + PATTERN_CHUNK, 2*start), dtype=np.uint64)
+        for _ in range(i):
+            odd = (n & np.uint64(1)).astype(bool)
+            n[odd] = (np.uint64(3) * n[odd] + np.uint64(1)) >> np.uint64(1)
+            n[~odd] >>= np.uint64(1)
+        chunks.append(1 - (n & np.uint64(1)).astype(np.uint8))
+
+    return ParityVector.from_array(np.concatenate(chunks))
 
 def get_patterns(npatterns):
     # the most efficient way of getting the pattern I know:
@@ -210,13 +260,8 @@ def get_patterns(npatterns):
 
     for i in range(npatterns):
         start = 2**(i+1)
-        _len = start
-        pattern = ''
-
-        for j in range(start, start+_len):
-            parity_seq = reduce_to_i(j, i+1)
-            pattern += parity_seq[i]
-            reductions += 1
+        pattern = column_pattern(i)
+        reductions += start
 
         pattern = rotate(pattern, -start+1)
         retvals.append(pattern)
@@ -227,11 +272,11 @@ def get_patterns(npatterns):
 def get_table(nrows=20, ncolumns=10):
     patterns = get_patterns(ncolumns)
 
-    rows = ['']*nrows
+    rows = [ParityVector(0, ncolumns) for r in range(nrows)]
 
     for c in range(ncolumns):
         for r in range(nrows):
-            rows[r] += patterns[c][r % len(patterns[c])]
+            rows[r].bits |= patterns[c][r % len(patterns[c])] << c
 
     return rows
 
@@ -253,7 +298,7 @@ def print_table(nrows=20, ncolumns=10, color_extension=False):
 
         for i in range(len(table)):
             nchars = len(reduce(i+1))
-            print('[{:>2}]  '.format(i+1) + YELLOW + table[i][:nchars] + WHITE + table[i][nchars:])
+            print('[{:>2}]  '.format(i+1) + YELLOW + str(table[i][:nchars]) + WHITE + str(table[i][nchars:]))
 
     return
 
@@ -262,11 +307,11 @@ def print_reduce_table(nrows=20):
         print(reduce(i+1))
 
 def get_patterns_ex(n):
-    retval = ['01']
+    retval = [ParityVector.from_string('01')]
     length = 2
 
     while len(retval) != n:
-        s = ''
+        s = ParityVector()
         length *= 2
 
         for i in range(length):
@@ -277,7 +322,7 @@ def get_patterns_ex(n):
                 offset = k/2
 
             offset = int(offset % len(retval[-1]))
-            s += retval[-1][offset]
+            s.append(retval[-1][offset])
 
         retval.append(s)
 
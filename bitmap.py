@@ -0,0 +1,83 @@
+import os
+import mmap
+
+
+# how many bytes prefix() scans at once
+PREFIX_CHUNK = 2**20
+
+# One bit per integer in [0, size), in memory or memory-mapped from a file so a
+# scan can pick up where it left off. Used by the serial scans to remember which
+# integers are already known to reach 1.
+class VerifiedBitmap:
+
+    def __init__(self, size, path=None):
+        self.size = size
+        nbytes = (size + 7) // 8
+
+        if path is None:
+            self.bits = bytearray(nbytes)
+            self.file = None
+        else:
+            mode = 'r+b' if os.path.exists(path) else 'w+b'
+            self.file = open(path, mode)
+            if os.path.getsize(path) < nbytes:
+                self.file.truncate(nbytes)
+            self.bits = mmap.mmap(self.file.fileno(), nbytes)
+
+    def __contains__(self, n):
+        return n < self.size and (self.bits[n >> 3] >> (n & 7)) & 1 == 1
+
+    def add(self, n):
+        if n < self.size:
+            self.bits[n >> 3] |= 1 << (n & 7)
+
+    # mark every integer in [lo, hi)
+    def add_range(self, lo, hi):
+        hi = min(hi, self.size)
+        while lo < hi and lo & 7:
+            self.add(lo)
+            lo += 1
+        while hi > lo and hi & 7:
+            hi -= 1
+            self.add(hi)
+        if lo < hi:
+            self.bits[lo >> 3:hi >> 3] = b'\xff' * ((hi - lo) >> 3)
+
+    # the smallest integer >= start that is not marked, everything below it is verified
+    def prefix(self, start=0):
+        n = start
+        while n < self.size and n & 7:
+            if n not in self:
+                return n
+            n += 1
+        # skip whole bytes of set bits a chunk at a time
+        i = n >> 3
+        while i < len(self.bits):
+            chunk = self.bits[i:i + PREFIX_CHUNK]
+            rest = chunk.lstrip(b'\xff')
+            i += len(chunk) - len(rest)
+            if rest:
+                break
+        n = i << 3
+        while n < self.size and n in self:
+            n += 1
+        return min(n, self.size)
+
+    def flush(self):
+        if self.file is not None:
+            self.bits.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.bits.close()
+            self.file.close()
+            self.file = None
+
+
+# The bitmap of coefficient coeff in directory, memory-mapped from the same file by
+# every scan that is given the directory, or in memory without one.
+def coefficient_bitmap(directory, coeff, size):
+    if directory is None:
+        return VerifiedBitmap(size)
+    os.makedirs(directory, exist_ok=True)
+    return VerifiedBitmap(size, os.path.join(directory, f'C_{coeff}.bitmap'))
@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import random
+
+
+# how often (in seconds) a long run writes its checkpoint
+CHECKPOINT_INTERVAL = 60
+
+
+# On-disk progress for long sweeps, kept as json so it can be read by hand.
+# For every coefficient we store the first integer not yet verified ('next'),
+# running status counts, and whether the coefficient is finished. The RNG state
+# is stored alongside so random tests continue with the same numbers.
+class Checkpoint:
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last_save = time.time()
+        self.state = {'coefficients': {}, 'rng': None}
+
+    # returns False when there is nothing to resume from
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            self.state = json.load(f)
+        return True
+
+    # write to a temporary file and swap it in, so an interrupt mid-write can't
+    # leave a truncated checkpoint behind
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
+
+    def due(self):
+        return time.time() - self.last_save >= self.interval
+
+    def save_if_due(self):
+        if self.due():
+            self.save()
+            return True
+        return False
+
+    def coefficient(self, coeff, start=1):
+        return self.state['coefficients'].setdefault(str(coeff), {'next': start, 'counts': {}, 'done': False, 'passed': None})
+
+    def update(self, coeff, next_n, counts=None):
+        entry = self.coefficient(coeff)
+        entry['next'] = next_n
+        if counts is not None:
+            entry['counts'] = {str(k): int(v) for k, v in counts.items()}
+
+    def finish(self, coeff, passed, result=None):
+        entry = self.coefficient(coeff)
+        entry['done'] = True
+        entry['passed'] = passed
+        if result is not None:
+            entry['result'] = result
+
+    def store_rng(self, rng=random):
+        version, internal, gauss_next = rng.getstate()
+        self.state['rng'] = [version, list(internal), gauss_next]
+
+    # returns False when no RNG state was saved
+    def restore_rng(self, rng=random):
+        if self.state['rng'] is None:
+            return False
+        version, internal, gauss_next = self.state['rng']
+        rng.setstate((version, tuple(internal), gauss_next))
+        return True
@@ -1,22 +1,50 @@
+import sys
 import time
-from multiprocessing import Pool, Value, Lock, cpu_count
-import sympy
+from multiprocessing import Pool, cpu_count
 import random
+from strip import bigint_engine, BIGINT_ENGINES, DEFAULT_BIGINT_ENGINE
 
 
 NUM_TESTS = 10000
 NBITS = 4096
 C_N = 33
-PRIMES = list(sympy.sieve.primerange(2, C_N))
+
+# a trajectory this many bits past its start has diverged; converging ones peak
+# a few dozen bits over
+BIT_MARGIN = 256
+
+# how many integers each worker takes at a time, big enough that pickling and
+# scheduling are noise next to the reductions
+CHUNK_SIZE = 64
+
+# the arbitrary precision engine the workers reduce with, set by init_worker
+engine = bigint_engine(DEFAULT_BIGINT_ENGINE)
+strip = engine.stripper(C_N)
+
+# whether a worker tests the rest of a chunk past a failure, and its divergence
+# margin, also set by init_worker
+keep_going = False
+bit_margin = BIT_MARGIN
+
+
+# witnesses is every (integer, 'looped' or 'diverged') found, witness the first
+class StressFailure(Exception):
+    def __init__(self, witnesses):
+        self.witnesses = witnesses
+        self.witness = witnesses[0][0]
+        super().__init__(f'C_{C_N} failed to reduce {len(witnesses)} integer(s) to 1, first {self.witness} ({witnesses[0][1]})')
+
+
+def init_worker(name, keep, margin=BIT_MARGIN):
+    global engine, strip, keep_going, bit_margin
+    engine = bigint_engine(name)
+    strip = engine.stripper(C_N)
+    keep_going = keep
+    bit_margin = margin
 
 
 def remove_small_primes(n):
-    for p in PRIMES:
-        if p >= C_N:
-            continue
-        while n % p == 0:
-            n //= p
-    return n
+    return strip(n)[0]
 
 
 def strong_reduce_once(n):
@@ -29,57 +57,117 @@ def strong_reduce_once(n):
         return C_N * n + 1
 
 
-def strong_generalized_collatz(n):
-    sequence = []
+# 'converged', 'looped', or 'diverged' once the hare is bit_margin bits past n
+def strong_generalized_collatz(n, bit_margin=BIT_MARGIN):
+    bit_limit = n.bit_length() + bit_margin
 
     turtle = n
     hare = n
 
     while True:
 
-        sequence.append(turtle)
         turtle = strong_reduce_once(turtle)
         hare = strong_reduce_once(hare)
         hare = strong_reduce_once(hare)
 
         if turtle == 1:
-            return turtle, True
-        
+            return 'converged'
+
         if turtle == hare:
-            return n, False
+            return 'looped'
 
+        if hare.bit_length() > bit_limit:
+            return 'diverged'
 
-def worker(num):
 
-    result = num
+# Reduce a chunk of integers, returning how many were tested and the (integer,
+# status) of each that didn't reach 1. Unless keep_going, a chunk stops at its
+# first failure.
+def worker(nums):
 
-    while result != 1:
-        result, success = strong_generalized_collatz(num)
+    failures = []
+    for i, num in enumerate(nums):
+        status = strong_generalized_collatz(engine.convert(num), bit_margin)
+        if status != 'converged':
+            failures.append((num, status))
+            if not keep_going:
+                return i + 1, failures
 
-    return result, success
+    return len(nums), failures
 
 
-def main():
+# the random integers to test, a chunk at a time
+def chunks(num_tests, nbits, chunk_size):
+    for lo in range(0, num_tests, chunk_size):
+        size = min(chunk_size, num_tests - lo)
+        yield [random.randint(2**(nbits-1), 2**nbits-1) for i in range(size)]
 
-    nworkers = cpu_count() // 2 
-    with Pool(processes=nworkers) as pool:
-        print('Generating numbers...')
-        nums = [random.randint(2**(NBITS-1), 2**NBITS-1) for i in range(NUM_TESTS)]
-        
-        print('Launching tests...')
-        def assert_one(result):
-            assert result[0] == 1
-            assert result[1] == True
-        for n in nums:
-            result = pool.apply_async(func=worker, args=(n,), callback=assert_one)
-
-        print('Joining processes...')
+
+# Stream chunks through every core. A failure raises StressFailure with its
+# witness, cancelling the work still outstanding; with keep_going every integer is
+# tested and the StressFailure at the end carries every witness.
+def run(num_tests=NUM_TESTS, nbits=NBITS, chunk_size=CHUNK_SIZE, nworkers=None, keep_going=False, engine=DEFAULT_BIGINT_ENGINE, bit_margin=BIT_MARGIN):
+
+    if nworkers is None:
+        nworkers = cpu_count()
+
+    engine = bigint_engine(engine).name
+
+    tested = 0
+    failures = []
+
+    pool = Pool(processes=nworkers, initializer=init_worker, initargs=(engine, keep_going, bit_margin))
+    try:
+        for count, found in pool.imap_unordered(worker, chunks(num_tests, nbits, chunk_size)):
+            tested += count
+            if not found:
+                continue
+            if not keep_going:
+                pool.terminate()
+                raise StressFailure(found)
+            for witness, status in found:
+                print(f'[C_{C_N}] {status}: {witness}')
+            failures += found
         pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
         pool.join()
 
-    print(f"numbers processed. all are 1")
+    if failures:
+        raise StressFailure(failures)
+
+    return tested
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=f'Stress test C_{C_N} on big random integers.')
+    parser.add_argument('--tests', type=int, default=NUM_TESTS)
+    parser.add_argument('--bits', type=int, default=NBITS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=cpu_count())
+    parser.add_argument('--keep-going', action='store_true',
+        help='Report every failure instead of cancelling at the first.')
+    parser.add_argument('--bit-margin', type=int, default=BIT_MARGIN,
+        help='Bits past its start at which a trajectory counts as diverged.')
+    parser.add_argument('--engine', choices=list(BIGINT_ENGINES), default=DEFAULT_BIGINT_ENGINE,
+        help='Arbitrary precision engine to reduce with.')
+    args = parser.parse_args()
+
+    t1 = time.time()
+    print(f'Launching tests on {args.workers} workers...')
+    try:
+        tested = run(args.tests, args.bits, args.chunk_size, args.workers, args.keep_going, args.engine, args.bit_margin)
+    except StressFailure as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"{tested} numbers processed. all are 1")
+    print(f'took {time.time() - t1} seconds.')
 
 
 if __name__ == "__main__":
     main()
-
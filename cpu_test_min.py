@@ -6,51 +6,132 @@ import pprint
 import random
 import sympy
 import time
+import functools
+from collections import Counter
+import cycles
+from bitmap import coefficient_bitmap
+from checkpoint import Checkpoint
 from rich.progress import Progress, MofNCompleteColumn
 
 primes = None
 bit_limit = 10000 # if you have more than 1M bits...
 
+# status is how the integer failed, 'looped' or 'diverged'
 class BadCoefficient(Exception):
-    pass
+    def __init__(self, message, status):
+        self.status = status
+        super().__init__(message)
 
-def _collatz(coefficient, n):
+@functools.lru_cache
+def small_primes(coefficient):
+    return list(sympy.sieve.primerange(coefficient))
+
+# With a verified bitmap the reduction stops as soon as it reaches an integer already
+# known to reach 1, and marks everything it passed through on the way.
+def _collatz(coefficient, n, method=cycles.DEFAULT_DETECTOR, verified=None):
     global total_reductions
 
     first_n = n
-    primes = list(sympy.sieve.primerange(coefficient))
+    primes = small_primes(coefficient)
 
-    seen = []
-    while True:
-        seen.append(n)
+    def strip(n):
         for p in primes:
             if p >= coefficient:
                 break
             while n % p == 0:
                 n = n // p
+        return n
+
+    def step(n):
+        return coefficient * strip(n) + 1
+
+    passed = []
+    detector = cycles.detector(step, n, method)
+    while True:
+        if verified is not None:
+            if n in verified:
+                break
+            passed.append(n)
+        n = strip(n)
         if n == 1:
             break
         n = coefficient * n + 1
-        if n in seen:
-            raise BadCoefficient(f'Loop detected:\n{seen}')
+        if detector.update(n):
+            cycle = cycles.locate(step, first_n, detector.length)
+            raise BadCoefficient(f'Loop detected from {first_n}: cycle of length {cycle.length} entered at {cycle.entry} after {cycle.tail} steps', 'looped')
         if n.bit_length() > bit_limit:
-            raise BadCoefficient('Diverged.')
+            raise BadCoefficient('Diverged.', 'diverged')
+
+    for m in passed:
+        verified.add(m)
     return
 
 if __name__ == "__main__":
-    SERIAL_MAX = 10000000
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serially test strong Collatz coefficients.')
+    parser.add_argument('--max', type=int, default=10000000,
+        help='Test every integer below this value.')
+    parser.add_argument('--checkpoint', default='cpu_test_min.checkpoint.json',
+        help='Where to periodically save progress.')
+    parser.add_argument('--resume', action='store_true',
+        help='Continue from the last checkpoint instead of starting over.')
+    parser.add_argument('--bitmap', default=None,
+        help='Directory to keep a memory-mapped verified bitmap per coefficient in, shared with cuda.py.')
+    args = parser.parse_args()
+
+    SERIAL_MAX = args.max
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.resume and checkpoint.load():
+        print(f'Resuming from {args.checkpoint}')
+
     seq = []
-    for coeff in range(3, 50, 2):
-        try:
-            # serial tests
-            with Progress() as progress:
-                task1 = progress.add_task(f"[green]testing C_{coeff}", total=SERIAL_MAX)
-                for i in range(1 , SERIAL_MAX):
-                    _collatz(coeff, i)
-                    progress.update(task1, advance=1)
-        except BadCoefficient:
-            continue
-        else:
-            print(f'Appending {coeff}')
-            seq.append(coeff)
+    try:
+        for coeff in range(3, 50, 2):
+            entry = checkpoint.coefficient(coeff)
+            if entry['done']:
+                if entry['passed']:
+                    seq.append(coeff)
+                continue
+
+            # how the integers tested so far ended ('converged', or the status of the
+            # one that failed), carried over from the checkpoint
+            counts = Counter(entry['counts'])
+
+            # every trajectory stops at the first integer below it, since those are all
+            # done. A bitmap kept on disk also remembers everything the trajectories
+            # passed through, so a resumed scan skips straight past what was verified.
+            verified = coefficient_bitmap(args.bitmap, coeff, SERIAL_MAX)
+            verified.add_range(1, entry['next'])
+            start = verified.prefix(entry['next'])
+            counts['converged'] += start - entry['next']
+            try:
+                # serial tests
+                with Progress() as progress:
+                    task1 = progress.add_task(f"[green]testing C_{coeff}", total=SERIAL_MAX, completed=start)
+                    for i in range(start, SERIAL_MAX):
+                        _collatz(coeff, i, verified=verified)
+                        counts['converged'] += 1
+                        progress.update(task1, advance=1)
+                        if i % 10000 == 0:
+                            checkpoint.update(coeff, i + 1, counts)
+                            if checkpoint.save_if_due():
+                                verified.flush()
+            except BadCoefficient as e:
+                counts[e.status] += 1
+                checkpoint.update(coeff, i + 1, counts)
+                checkpoint.finish(coeff, False)
+            else:
+                print(f'Appending {coeff}')
+                seq.append(coeff)
+                checkpoint.update(coeff, SERIAL_MAX, counts)
+                checkpoint.finish(coeff, True)
+            print(f'[C_{coeff}] ' + ', '.join(f'{count} {status}' for status, count in sorted(counts.items())))
+            verified.close()
+            checkpoint.save()
+    except KeyboardInterrupt:
+        checkpoint.save()
+        print(f'Interrupted, progress saved to {args.checkpoint}. Rerun with --resume to continue.')
+        sys.exit(1)
+
     print(f'Done. Sequence: {seq}')
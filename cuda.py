@@ -3,9 +3,21 @@ import numpy as np
 import math
 import pprint
 import random
-from numba import cuda, uint64, jit, uint8, uint32
+from numba import cuda, uint64, jit, njit, prange, uint8, uint32
 import sympy
 import time
+import queue
+import threading
+import cycles
+from lockstep import collatz_lockstep
+from checkpoint import Checkpoint
+from strip import strip_table, strip_u64, wide_strip_table, strip_u192, bigint_engine, BIGINT_ENGINES, DEFAULT_BIGINT_ENGINE
+from wide import muladd192, gt192, to_limbs, from_limbs
+from registry import CycleRegistry, known_cycle, REGISTRY_PATH
+from stats import Stats, Trajectory
+from escalation import Escalation
+from witness import Witnesses, WITNESS_PATH, record_int
+from bitmap import coefficient_bitmap
 
 
 primes = None
@@ -41,10 +53,45 @@ LOOP_DETECTED = 3
 ABANDONED = 4
 OVERFLOW = 5
 ERROR = 6
+# dropped below its start onto an integer of the same run that may not be settled
+# yet; it converges if that one does
+DEFERRED = 7
 
 STATUS_STOP = 1
 STATUS_CONTINUE = 0
 
+STATUS_NAMES = {
+    CONVERGED: 'converged',
+    DIVERGED: 'diverged',
+    LOOP_DETECTED: 'looped',
+    ABANDONED: 'abandoned',
+    OVERFLOW: 'overflowed',
+    ERROR: 'error',
+    DEFERRED: 'deferred',
+}
+
+U64_MAX = 2**64 - 1
+
+# per-lane results are kept a byte wide, UNINITIALIZED truncates to this
+STATUS_DTYPE = np.uint8
+UNINITIALIZED_STATUS = 255
+
+# how many integers are generated and reduced at once, and how many chunks may be
+# waiting on the generator thread
+CHUNK_SIZE = 2**24
+CHUNK_QUEUE_DEPTH = 2
+
+# how many uint64 limbs the wide backend works in, 192 bits
+LIMBS = 3
+
+# random inputs past 64 bits for the wide backend, and its divergence cap
+RANDOM_WIDE_ELEMENT_MIN = 2**60
+RANDOM_WIDE_ELEMENT_MAX = 2**100
+WIDE_DIVERGENCE_CAP = 2**190
+
+# run on the gpu when we have one, otherwise fall back to every cpu core
+BACKEND = 'gpu' if cuda.is_available() else 'cpu'
+
 @cuda.jit
 def collatz_reduce(_n, _coeff, _divergence_limit, primes):
 
@@ -72,10 +119,7 @@ def collatz_reduce(_n, _coeff, _divergence_limit, primes):
     
     new_n = coeff * n + 1
 
-    if new_n > divergence_limit:
-        print('coeff', coeff, 'diverged', new_n)
-        return DIVERGED, new_n
-    
+    # a wrapped product can land anywhere, so it is caught before the cap is checked
     if new_n < n:
         #print('coeff', coeff, 'overflow', orig_n, new_n)
         return OVERFLOW, new_n
@@ -85,11 +129,15 @@ def collatz_reduce(_n, _coeff, _divergence_limit, primes):
         #print('coeff', coeff, 'overflow2', n, test, new_n)
         return OVERFLOW, new_n
 
+    if new_n > divergence_limit:
+        print('coeff', coeff, 'diverged', new_n)
+        return DIVERGED, new_n
+
     return CONTINUE, new_n
 
 
 @cuda.jit
-def collatz_cuda(n_arr, coeff, divergence_limit, results, status_flag, primes_array):
+def collatz_cuda(n_arr, coeff, divergence_limit, results, status_flag, primes_array, values, steps, peaks):
 
     idx = cuda.grid(1)
     if idx < n_arr.size:  # Check within array bounds
@@ -102,30 +150,56 @@ def collatz_cuda(n_arr, coeff, divergence_limit, results, status_flag, primes_ar
         hare2 = hare
         previous_collision = False
 
+        # how many steps hare2 has taken, and the largest value it has seen
+        hare_steps = 0
+        peak = n
+
         # calculate the result
         while True:
 
             status1, new_turtle = collatz_reduce(turtle, coeff, divergence_limit, primes_array)
             status2, hare1 = collatz_reduce(hare2, coeff, divergence_limit, primes_array)
-            status3, hare2 = collatz_reduce(hare1, coeff, divergence_limit, primes_array)
-
-            if idx == 1:
-                print(status1, status2, status3)
-                print(turtle, new_turtle)
-                print(hare1, hare2)
+            status3, new_hare2 = collatz_reduce(hare1, coeff, divergence_limit, primes_array)
 
             if status1 == CONVERGED or status2 == CONVERGED or status3 == CONVERGED:
                 result = CONVERGED  # Converged
                 break 
             
-            if status1 == DIVERGED or status2 == DIVERGED:
+            if status2 == DIVERGED:
+                result = DIVERGED
+                values[idx] = hare1
+                steps[idx] = hare_steps + 1
+                break
+
+            if status3 == DIVERGED:
+                result = DIVERGED
+                values[idx] = new_hare2
+                steps[idx] = hare_steps + 2
+                break
+
+            if status1 == DIVERGED:
                 result = DIVERGED
+                values[idx] = new_turtle
+                steps[idx] = hare_steps // 2 + 1
                 break
 
-            if status1 == OVERFLOW or status2 == OVERFLOW:
+            # leave the last value that fit for the continuation on the host, the
+            # rest of the batch carries on
+            if status2 == OVERFLOW:
                 result = OVERFLOW
-                status_flag[0] = STATUS_STOP
+                values[idx] = hare2
+                steps[idx] = hare_steps
+                break
+
+            if status3 == OVERFLOW:
+                result = OVERFLOW
+                values[idx] = hare1
+                steps[idx] = hare_steps + 1
                 break
+
+            hare2 = new_hare2
+            hare_steps += 2
+            peak = max(peak, hare1, hare2)
             
             if turtle == hare2: # loop detected
                 if not previous_collision:
@@ -133,78 +207,720 @@ def collatz_cuda(n_arr, coeff, divergence_limit, results, status_flag, primes_ar
                 else:
                     #print('Looped processing ', coeff, n, turtle, hare1, hare2)
                     result = LOOP_DETECTED
+                    values[idx] = hare2
+                    steps[idx] = hare_steps
                     status_flag[0] = STATUS_STOP
                     break
             
             if status_flag[0] != 0:
                 result = ABANDONED
+                values[idx] = hare2
+                steps[idx] = hare_steps
                 break
 
             if new_turtle == turtle:
                 result = ERROR
+                values[idx] = turtle
+                steps[idx] = hare_steps // 2 - 1
                 status_flag[0] = STATUS_STOP
                 break
 
             turtle = new_turtle
 
         results[idx] = result
+        peaks[idx] = peak
 
     else:
         raise Exception()
 
 
-def test_coefficients_gpu(coeffs, test_size, divergence_limit, ele_min, ele_max, method=None):
+# CPU twin of collatz_reduce. Everything is pinned to uint64, numba would otherwise
+# unify the mixed int64/uint64 arithmetic to float64.
+@njit(nogil=True)
+def collatz_reduce_cpu(_n, _coeff, _divergence_limit, table):
 
-    results = {}
-    threads_per_block = 1024
+    coeff = uint64(_coeff)
+    divergence_limit = uint64(_divergence_limit)
 
-    for coeff in coeffs:
+    # Remove primes smaller than coeff
+    n, early_return = strip_u64(_n, table)
+
+    if n == 1:
+        return CONVERGED, uint64(1)
+
+    if early_return:
+        return CONTINUE, n
+
+    new_n = coeff * n + uint64(1)
+
+    # a wrapped product can land anywhere, so it is caught before the cap is checked
+    if new_n < n:
+        return OVERFLOW, new_n
+
+    test = new_n - uint64(1)
+    if test % coeff != 0 or test // coeff != n:
+        return OVERFLOW, new_n
+
+    if new_n > divergence_limit:
+        return DIVERGED, new_n
+
+    return CONTINUE, new_n
+
+
+# One lane of collatz_cpu: reduce n with turtle/hare and return its status code,
+# plus the minimal element of the cycle it fell into (0 if it didn't, or if the
+# cycle isn't in the registry yet). status_flag is shared with the other lanes, a
+# loop here abandons them.
+#
+# For the witness records it also returns where the lane stopped, the number of
+# steps from n to there, and the largest value on the way. Where it stopped is a
+# member of the cycle for a loop, the value past the limit for a divergence, and
+# for an overflow the last value that fit, which the host carries on from in
+# arbitrary precision (see escalation.py). A lane that overflows doesn't stop the
+# others.
+#
+# members/owners are the registry's known cycle members (see registry.py). A hare
+# landing on one is a loop straight away, without waiting for the turtle.
+#
+# Every integer below verified_below is known to reach 1, so a lane that drops
+# below it has converged. stop_below is for serial runs starting at 1: every integer
+# below a lane's start is tested by the same run, so a lane that drops below its
+# start is DEFERRED to that integer, which may be in the same chunk and not settled.
+@njit(nogil=True)
+def collatz_lane_cpu(n, coeff, divergence_limit, status_flag, table, stop_below, verified_below, members, owners):
+
+    turtle = n
+    hare1 = n
+    hare2 = n
+    previous_collision = False
+    result = UNINITIALIZED
+    cycle = uint64(0)
+    value = uint64(0)
+
+    # how many steps hare2 has taken, and the largest value it has seen
+    steps = uint64(0)
+    peak = n
+
+    # calculate the result
+    while True:
+
+        status1, new_turtle = collatz_reduce_cpu(turtle, coeff, divergence_limit, table)
+        status2, hare1 = collatz_reduce_cpu(hare2, coeff, divergence_limit, table)
+        status3, new_hare2 = collatz_reduce_cpu(hare1, coeff, divergence_limit, table)
+
+        if status1 == CONVERGED or status2 == CONVERGED or status3 == CONVERGED:
+            result = CONVERGED
+            break
+
+        if status2 == DIVERGED:
+            result = DIVERGED
+            value = hare1
+            steps += uint64(1)
+            break
+
+        if status3 == DIVERGED:
+            result = DIVERGED
+            value = new_hare2
+            steps += uint64(2)
+            break
+
+        if status1 == DIVERGED:
+            result = DIVERGED
+            value = new_turtle
+            steps = steps // uint64(2) + uint64(1)
+            break
+
+        # the hare is ahead of the turtle, so it is always the one to overflow
+        if status2 == OVERFLOW:
+            result = OVERFLOW
+            value = hare2
+            break
+
+        if status3 == OVERFLOW:
+            result = OVERFLOW
+            value = hare1
+            steps += uint64(1)
+            break
+
+        hare2 = new_hare2
+        steps += uint64(2)
+        peak = max(peak, hare1, hare2)
+
+        low = min(new_turtle, hare1, hare2)
+        if low < verified_below:
+            result = CONVERGED
+            break
+
+        if stop_below and low < n:
+            result = DEFERRED
+            break
+
+        cycle = known_cycle(hare1, members, owners)
+        if cycle != 0:
+            result = LOOP_DETECTED
+            value = hare1
+            steps -= uint64(1)
+            status_flag[0] = STATUS_STOP
+            break
+
+        cycle = known_cycle(hare2, members, owners)
+        if cycle != 0:
+            result = LOOP_DETECTED
+            value = hare2
+            status_flag[0] = STATUS_STOP
+            break
+
+        if turtle == hare2: # loop detected
+            if not previous_collision:
+                previous_collision = True # you get one pass
+            else:
+                result = LOOP_DETECTED
+                value = hare2
+                status_flag[0] = STATUS_STOP
+                break
+
+        if status_flag[0] != 0:
+            result = ABANDONED
+            value = hare2
+            break
+
+        if new_turtle == turtle:
+            result = ERROR
+            value = turtle
+            steps = steps // uint64(2) - uint64(1)
+            status_flag[0] = STATUS_STOP
+            break
+
+        turtle = new_turtle
+
+    return result, cycle, value, steps, peak
+
+
+# CPU twin of collatz_cuda: one prange iteration per lane, sharing status_flag
+# between threads so a loop abandons the rest of the batch. hits[idx] gets the known
+# cycle lane idx fell into, if any, and values, steps and peaks what
+# collatz_lane_cpu says about where it stopped.
+@njit(parallel=True, nogil=True)
+def collatz_cpu(n_arr, coeff, divergence_limit, results, status_flag, table, stop_below, verified_below, members, owners, hits, values, steps, peaks):
+
+    for idx in prange(n_arr.size):
+        results[idx], hits[idx], values[idx], steps[idx], peaks[idx] = collatz_lane_cpu(n_arr[idx], coeff, divergence_limit, status_flag, table, stop_below, verified_below, members, owners)
+
+
+# Three-limb twin of collatz_reduce_cpu, for values up to 192 bits. n and the
+# divergence limit are (hi, mid, lo) triples. OVERFLOW means the next value did
+# not fit 192 bits.
+@njit(nogil=True)
+def collatz_reduce_wide(n2, n1, n0, coeff, lim2, lim1, lim0, table):
+
+    coeff = uint64(coeff)
+
+    # Remove primes smaller than coeff
+    m2, m1, m0, early_return = strip_u192(n2, n1, n0, table)
+
+    if m2 == 0 and m1 == 0 and m0 == 1:
+        return CONVERGED, m2, m1, m0
 
-        # our list of primes
+    if early_return:
+        return CONTINUE, m2, m1, m0
+
+    r2, r1, r0, overflow = muladd192(m2, m1, m0, coeff, uint64(1))
+
+    if overflow:
+        return OVERFLOW, r2, r1, r0
+
+    if gt192(r2, r1, r0, lim2, lim1, lim0):
+        return DIVERGED, r2, r1, r0
+
+    return CONTINUE, r2, r1, r0
+
+
+# collatz_lane_cpu on three limbs. The registry only holds 64-bit members, so it is
+# only consulted once a hare fits one limb. The value where the lane stopped and its
+# peak come back as limbs, highest first.
+@njit(nogil=True)
+def collatz_wide_lane_cpu(n2, n1, n0, coeff, lim2, lim1, lim0, status_flag, table, members, owners):
+
+    t2, t1, t0 = n2, n1, n0
+    h2, h1, h0 = n2, n1, n0
+    previous_collision = False
+    result = UNINITIALIZED
+    cycle = uint64(0)
+    v2, v1, v0 = uint64(0), uint64(0), uint64(0)
+
+    # how many steps the hare has taken, and the largest value it has seen
+    steps = uint64(0)
+    p2, p1, p0 = n2, n1, n0
+
+    # calculate the result
+    while True:
+
+        status1, u2, u1, u0 = collatz_reduce_wide(t2, t1, t0, coeff, lim2, lim1, lim0, table)
+        status2, a2, a1, a0 = collatz_reduce_wide(h2, h1, h0, coeff, lim2, lim1, lim0, table)
+        status3, b2, b1, b0 = collatz_reduce_wide(a2, a1, a0, coeff, lim2, lim1, lim0, table)
+
+        if status1 == CONVERGED or status2 == CONVERGED or status3 == CONVERGED:
+            result = CONVERGED
+            break
+
+        if status2 == DIVERGED:
+            result = DIVERGED
+            v2, v1, v0 = a2, a1, a0
+            steps += uint64(1)
+            break
+
+        if status3 == DIVERGED:
+            result = DIVERGED
+            v2, v1, v0 = b2, b1, b0
+            steps += uint64(2)
+            break
+
+        if status1 == DIVERGED:
+            result = DIVERGED
+            v2, v1, v0 = u2, u1, u0
+            steps = steps // uint64(2) + uint64(1)
+            break
+
+        if status2 == OVERFLOW:
+            result = OVERFLOW
+            v2, v1, v0 = h2, h1, h0
+            break
+
+        if status3 == OVERFLOW:
+            result = OVERFLOW
+            v2, v1, v0 = a2, a1, a0
+            steps += uint64(1)
+            break
+
+        h2, h1, h0 = b2, b1, b0
+        steps += uint64(2)
+        if gt192(a2, a1, a0, p2, p1, p0):
+            p2, p1, p0 = a2, a1, a0
+        if gt192(h2, h1, h0, p2, p1, p0):
+            p2, p1, p0 = h2, h1, h0
+
+        if a2 == 0 and a1 == 0:
+            cycle = known_cycle(a0, members, owners)
+        if cycle != 0:
+            result = LOOP_DETECTED
+            v2, v1, v0 = a2, a1, a0
+            steps -= uint64(1)
+            status_flag[0] = STATUS_STOP
+            break
+
+        if h2 == 0 and h1 == 0:
+            cycle = known_cycle(h0, members, owners)
+        if cycle != 0:
+            result = LOOP_DETECTED
+            v2, v1, v0 = h2, h1, h0
+            status_flag[0] = STATUS_STOP
+            break
+
+        if t2 == h2 and t1 == h1 and t0 == h0: # loop detected
+            if not previous_collision:
+                previous_collision = True # you get one pass
+            else:
+                result = LOOP_DETECTED
+                v2, v1, v0 = h2, h1, h0
+                status_flag[0] = STATUS_STOP
+                break
+
+        if status_flag[0] != 0:
+            result = ABANDONED
+            v2, v1, v0 = h2, h1, h0
+            break
+
+        if u2 == t2 and u1 == t1 and u0 == t0:
+            result = ERROR
+            v2, v1, v0 = t2, t1, t0
+            steps = steps // uint64(2) - uint64(1)
+            status_flag[0] = STATUS_STOP
+            break
+
+        t2, t1, t0 = u2, u1, u0
+
+    return result, cycle, v2, v1, v0, steps, p2, p1, p0
+
+
+# collatz_cpu for inputs wider than 64 bits. n_arr[idx] holds the limbs of lane idx,
+# lowest first, as many as the inputs need (up to three); limit is the divergence
+# limit's limbs, highest first. values and peaks have LIMBS columns, lowest first.
+@njit(parallel=True, nogil=True)
+def collatz_wide_cpu(n_arr, coeff, limit, results, status_flag, table, members, owners, hits, values, steps, peaks):
+
+    nlimbs = n_arr.shape[1]
+    for idx in prange(n_arr.shape[0]):
+        n0 = n_arr[idx, 0]
+        n1 = n_arr[idx, 1] if nlimbs > 1 else uint64(0)
+        n2 = n_arr[idx, 2] if nlimbs > 2 else uint64(0)
+        result, cycle, v2, v1, v0, lane_steps, p2, p1, p0 = collatz_wide_lane_cpu(n2, n1, n0, coeff, limit[0], limit[1], limit[2], status_flag, table, members, owners)
+        results[idx] = result
+        hits[idx] = cycle
+        values[idx, 0] = v0
+        values[idx, 1] = v1
+        values[idx, 2] = v2
+        steps[idx] = lane_steps
+        peaks[idx, 0] = p0
+        peaks[idx, 1] = p1
+        peaks[idx, 2] = p2
+
+
+# Uniform integers in [lo, hi] as (size, LIMBS) uint64 limbs, lowest first, for
+# ranges past 64 bits. Random bits are drawn a limb at a time and anything past
+# hi - lo is redrawn.
+def random_limbs(rng, lo, hi, size):
+    span = hi - lo
+    nbits = span.bit_length()
+    if nbits > 64 * LIMBS:
+        raise Exception(f'Wide inputs are limited to {64 * LIMBS} bits')
+    span_limbs = to_limbs(span)[::-1]
+    top = (nbits - 1) // 64
+
+    out = np.zeros((0, LIMBS), dtype=np.uint64)
+    while out.shape[0] < size:
+        draw = np.zeros((size, LIMBS), dtype=np.uint64)
+        for i in range(top + 1):
+            draw[:, i] = rng.integers(0, 2**64, size=size, dtype=np.uint64, endpoint=False)
+        draw[:, top] >>= np.uint64(64 * (top + 1) - nbits)
+
+        # keep draws <= span, comparing from the top limb down
+        keep = np.ones(size, dtype=bool)
+        decided = np.zeros(size, dtype=bool)
+        for i in range(LIMBS - 1, -1, -1):
+            limb = np.uint64(span_limbs[i])
+            keep &= decided | (draw[:, i] <= limb)
+            decided |= draw[:, i] < limb
+        out = np.concatenate([out, draw[keep]])
+    out = out[:size]
+
+    # add lo, carrying between limbs
+    carry = np.zeros(size, dtype=np.uint64)
+    for i, limb in enumerate(to_limbs(lo)[::-1]):
+        total = out[:, i] + np.uint64(limb)
+        wrapped = total < out[:, i]
+        total += carry
+        wrapped |= total < carry
+        out[:, i] = total
+        carry = wrapped.astype(np.uint64)
+
+    return out
+
+
+# Inputs are generated and reduced a chunk at a time, so memory stays flat however
+# many integers a run covers. A background thread builds the next chunk while the
+# current one is being reduced.
+def generate_chunks(method, total, ele_min, ele_max, chunk_size, seed, start=0, wide=False):
+
+    chunks = queue.Queue(maxsize=CHUNK_QUEUE_DEPTH)
+    stop = threading.Event()
+
+    # a put gives up once the consumer has stopped, so the thread never blocks on a
+    # full queue nobody reads
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        for lo in range(start, total, chunk_size):
+            if stop.is_set():
+                return
+            size = min(chunk_size, total - lo)
+            if method == 'random':
+                # seeded by chunk, so a resumed run regenerates the same integers
+                rng = np.random.default_rng([seed, lo])
+                if wide:
+                    n_arr = random_limbs(rng, ele_min, ele_max, size)
+                else:
+                    n_arr = rng.integers(ele_min, ele_max, size=size, dtype=np.uint64, endpoint=True)
+            elif wide:
+                n_arr = np.zeros((size, LIMBS), dtype=np.uint64)
+                n_arr[:, 0] = np.arange(ele_min + lo, ele_min + lo + size, dtype=np.uint64)
+            else:
+                n_arr = np.arange(ele_min + lo, ele_min + lo + size, dtype=np.uint64)
+
+            put((lo, n_arr))
+        put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        stop.set()
+
+
+# how many looping lanes a chunk follows up on to find cycles the registry is missing
+DISCOVER_LIMIT = 16
+
+
+# The largest value each fixed-width kernel holds. Their overflowed lanes went past
+# it, so under a divergence limit no bigger they have simply diverged; above it they
+# are handed on to escalation.py. The numpy backend stops the batch at the first
+# overflow instead.
+KERNEL_MAX = {
+    'gpu': U64_MAX,
+    'cpu': U64_MAX,
+    'wide': 2**(64 * LIMBS) - 1,
+}
+
+
+def reduce_chunk(n_arr, coeff, divergence_limit, result_arr, status_flag, backend, stop_below, verified_below, registry, hits, values, steps, peaks):
+
+    if backend == 'gpu':
+        threads_per_block = 1024
+        blocks_per_grid = math.ceil(n_arr.size / threads_per_block)
         primes = np.array(list(sympy.sieve.primerange(coeff)))
+        collatz_cuda[blocks_per_grid, threads_per_block](n_arr, coeff, uint64(min(int(divergence_limit), U64_MAX)), result_arr, status_flag, primes, values, steps, peaks)
+    elif backend == 'cpu':
+        members, owners = registry.members(coeff)
+        collatz_cpu(n_arr, uint64(coeff), uint64(min(int(divergence_limit), U64_MAX)), result_arr, status_flag, strip_table(coeff), stop_below, uint64(verified_below), members, owners, hits, values, steps, peaks)
+    elif backend == 'numpy':
+        result_arr[:] = collatz_lockstep(n_arr, coeff, divergence_limit, registry=registry, hits=hits, values=values, steps=steps, peaks=peaks)
+        if np.any((result_arr == LOOP_DETECTED) | (result_arr == OVERFLOW)):
+            status_flag[0] = STATUS_STOP
+    elif backend == 'wide':
+        members, owners = registry.members(coeff)
+        limit = np.array(to_limbs(min(int(divergence_limit), 2**(64 * LIMBS) - 1)), dtype=np.uint64)
+        collatz_wide_cpu(n_arr, uint64(coeff), limit, result_arr, status_flag, wide_strip_table(coeff), members, owners, hits, values, steps, peaks)
+    else:
+        raise Exception('Unknown backend')
+
+
+# The lanes of a chunk that overflowed, as escalation.py takes them: the position in
+# the run, the last value that fit the kernel, and the steps taken to get there
+def overflowed_lanes(lo, result_arr, values, steps):
+    lanes = []
+    for idx in np.flatnonzero(result_arr == OVERFLOW):
+        n = from_limbs(*values[idx][::-1]) if values.ndim == 2 else int(values[idx])
+        lanes.append((lo + int(idx), n, int(steps[idx])))
+    return lanes
+
+
+# Fold lanes that came back from the continuation pool into the counts and witness
+# records, in place of the OVERFLOW the kernel wrote for them. Loops are registered
+# and tallied like the kernel's own, and stop the run like them.
+def merge_escalated(coeff, finished, counts, status_flag, registry, cycle_hits, escalated, witnesses, key):
+    for position, status, lane_steps, peak_bits, value in finished:
+        counts[OVERFLOW] -= 1
+        counts[status] += 1
+        escalated[status] = escalated.get(status, 0) + 1
+        minimum = 0
+        if status == LOOP_DETECTED:
+            minimum, new = registry.add(coeff, value)
+            if new:
+                print(f'[C_{coeff}] new cycle of length {registry.cycles[coeff][minimum]} with minimal element {minimum}')
+            cycle_hits[minimum] = cycle_hits.get(minimum, 0) + 1
+            status_flag[0] = STATUS_STOP
+        if witnesses is not None:
+            witnesses.update(key, position, status, lane_steps, peak_bits, value, minimum if minimum <= U64_MAX else 0)
+
+
+# the first few witness records of a run
+WITNESS_PRINT_LIMIT = 4
+
+
+def print_witnesses(coeff, records):
+    for record in records[:WITNESS_PRINT_LIMIT]:
+        print(f'[C_{coeff}] {STATUS_NAMES.get(int(record["status"]), "uninitialized")}: {record_int(record["start"])} stopped at {record_int(record["value"])} after {record["steps"]} steps, peaking at {record["peak_bits"]} bits')
+    if records.size > WITNESS_PRINT_LIMIT:
+        print(f'[C_{coeff}] ... and {records.size - WITNESS_PRINT_LIMIT} more witness records')
+
+
+# Tally which cycle every looping lane of a chunk fell into. Lanes that looped into
+# a cycle the registry doesn't know yet are followed up on the CPU to add it.
+def record_cycles(coeff, n_arr, result_arr, hits, registry, cycle_hits):
+    looped = np.flatnonzero(result_arr == LOOP_DETECTED)
+    unknown = looped[hits[looped] == 0]
+    for idx in unknown[:DISCOVER_LIMIT]:
+        n = from_limbs(*n_arr[idx][::-1]) if n_arr.ndim == 2 else int(n_arr[idx])
+        minimum, new = registry.discover(coeff, n)
+        if new:
+            print(f'[C_{coeff}] new cycle of length {registry.cycles[coeff][minimum]} with minimal element {minimum}')
+        if minimum is not None and minimum <= U64_MAX:
+            hits[idx] = minimum
+
+    for minimum in hits[looped]:
+        if minimum != 0:
+            cycle_hits[int(minimum)] = cycle_hits.get(int(minimum), 0) + 1
+
+
+# Every lane that doesn't converge leaves a record in witnesses (see witness.py),
+# keyed like the checkpoint, when one is given.
+#
+# A serial run keeps the integers known to reach 1 as a prefix [1, verified_below):
+# a chunk joins it once every lane in it converged or was deferred, since a lane
+# deferred to a smaller integer of the same chunk converges with it. With a bitmap
+# directory the prefix is kept in the coefficient's bitmap there (see bitmap.py),
+# shared with cpu_test_min, so a run starts from whatever an earlier one verified.
+def test_coefficients_gpu(coeffs, test_size, divergence_limit, ele_min, ele_max, method=None, backend=BACKEND, chunk_size=CHUNK_SIZE, checkpoint=None, registry=None, witnesses=None, bitmap=None):
 
-        # array of test elements
-        n_arr = np.full(test_size+1, 0, dtype=np.uint64)
+    results = {}
 
-        # where we will store the result of each calculation
-        result_arr = np.full(test_size+1, UNINITIALIZED, dtype=np.uint64)
-        
-        # an array of a single element, to check tom abandon processing
-        status_flag = np.full(1, 0)
+    if method not in ('random', 'serial'):
+        raise Exception('Unknown method')
+    if method == 'serial' and ele_max != None:
+        raise Exception('Serial tests do not incorporate ele_max, they use ele_min + test_size')
+
+    total = test_size + 1
+
+    if registry is None:
+        registry = CycleRegistry()
+        registry.load()
+
+    for coeff in coeffs:
 
-        # fill the array with random elements of the appropriate size
         t1 = time.time()
         if method == 'random':
             print(f'------ Random [{coeff}] ------')
             print(f'[C_{coeff}] Sampling random integers in the interval ({ele_min}[2^{int(math.log(ele_min,2))}], {ele_max}[2^{int(math.log(ele_max,2))}])')
-            for idx in range(len(n_arr)):
-                n_arr[idx] = uint64(random.randint(ele_min, ele_max))
-        elif method == 'serial':
-            if ele_max != None:
-                raise Exception('Serial tests do not incorporate ele_max, they use ele_min + test_size')
-            print(f'------ Serial [{coeff}] ------')
-            print(f'[C_{coeff}] Testing {len(n_arr)} integers in serial beginning at {ele_min}')
-            for idx in range(len(n_arr)):
-                n_arr[idx] = ele_min+idx
         else:
-            raise Exception('Unknown method')
+            print(f'------ Serial [{coeff}] ------')
+            print(f'[C_{coeff}] Testing {total} integers in serial beginning at {ele_min}')
+
+        key = f'{method}-{coeff}'
+
+        # running count of every status code seen so far
+        counts = np.zeros(256, dtype=np.int64)
+        start = 0
+        seed = random.getrandbits(64)
+
+        entry = None
+        if checkpoint is not None:
+            entry = checkpoint.coefficient(key, start=0)
+            if entry['done']:
+                results[coeff] = entry['result']
+                print(f'[C_{coeff}] {results[coeff]} (from checkpoint)')
+                continue
+            start = entry['next']
+            seed = entry.setdefault('seed', seed)
+            for code, count in entry['counts'].items():
+                counts[int(code)] = count
+
+        # records from a run we aren't resuming are stale
+        if witnesses is not None and start == 0:
+            witnesses.reset(key)
 
-        blocks_per_grid = math.ceil(n_arr.size / threads_per_block)
-        collatz_cuda[blocks_per_grid, threads_per_block](n_arr, coeff, divergence_limit, result_arr, status_flag, primes)
-        
-        if np.all(result_arr == CONVERGED):
+        # an array of a single element, to check tom abandon processing
+        status_flag = np.full(1, 0)
+
+        # every integer below a lane is tested by the chunks before it or its own
+        stop_below = method == 'serial' and ele_min == 1
+
+        verified = None
+        verified_below = 1
+        if method == 'serial' and bitmap is not None:
+            verified = coefficient_bitmap(bitmap, coeff, ele_min + total)
+            verified_below = verified.prefix(1)
+        # the chunks of a resumed run so far all converged or were deferred
+        if stop_below and counts[CONVERGED] + counts[DEFERRED] == start:
+            verified_below = max(verified_below, 1 + start)
+
+        # how many lanes hit each known cycle, by minimal element
+        cycle_hits = {}
+
+        # overflowed lanes carry on in Python ints while the next chunks run, when
+        # the divergence limit is past what the kernel holds
+        escalation = None
+        if backend in KERNEL_MAX and divergence_limit > KERNEL_MAX[backend]:
+            escalation = Escalation(coeff, divergence_limit)
+
+        # how the escalated lanes came out, by status
+        escalated = {}
+
+        processed = start
+        try:
+            for lo, n_arr in generate_chunks(method, total, ele_min, ele_max, chunk_size, seed, start, wide=backend == 'wide'):
+
+                # where we will store the result of each calculation
+                result_arr = np.full(n_arr.shape[0], UNINITIALIZED_STATUS, dtype=STATUS_DTYPE)
+
+                hits = np.zeros(n_arr.shape[0], dtype=np.uint64)
+
+                # where each lane stopped, after how many steps, and its largest value
+                shape = (n_arr.shape[0], LIMBS) if backend == 'wide' else n_arr.shape[0]
+                values = np.zeros(shape, dtype=np.uint64)
+                steps = np.zeros(n_arr.shape[0], dtype=np.uint64)
+                peaks = np.zeros(shape, dtype=np.uint64)
+
+                reduce_chunk(n_arr, coeff, divergence_limit, result_arr, status_flag, backend, stop_below, verified_below, registry, hits, values, steps, peaks)
+                record_cycles(coeff, n_arr, result_arr, hits, registry, cycle_hits)
+                if witnesses is not None:
+                    witnesses.add(key, lo, n_arr, result_arr, hits, values, steps, peaks)
+                # recorded as overflows first, since their values are the last that fit
+                if backend in KERNEL_MAX and escalation is None:
+                    result_arr[result_arr == OVERFLOW] = DIVERGED
+
+                counts += np.bincount(result_arr, minlength=256)
+                processed = lo + n_arr.shape[0]
+
+                if method == 'serial' and ele_min + lo <= verified_below and np.all((result_arr == CONVERGED) | (result_arr == DEFERRED)):
+                    verified_below = max(verified_below, ele_min + processed)
+                    if verified is not None:
+                        verified.add_range(ele_min + lo, verified_below)
+                        verified_below = verified.prefix(verified_below)
+
+                if escalation is not None:
+                    escalation.submit(overflowed_lanes(lo, result_arr, values, steps))
+                    # a checkpoint only goes to disk with every escalated lane settled
+                    wait = checkpoint is not None and checkpoint.due()
+                    merge_escalated(coeff, escalation.done(wait), counts, status_flag, registry, cycle_hits, escalated, witnesses, key)
+
+                if checkpoint is not None:
+                    if escalation is None or not escalation.pending:
+                        checkpoint.update(key, processed, {code: counts[code] for code in np.flatnonzero(counts)})
+                    if checkpoint.save_if_due():
+                        if witnesses is not None:
+                            witnesses.save()
+                        if verified is not None:
+                            verified.flush()
+
+                if status_flag[0] != 0:
+                    break
+
+            if escalation is not None:
+                merge_escalated(coeff, escalation.done(wait=True), counts, status_flag, registry, cycle_hits, escalated, witnesses, key)
+        finally:
+            if escalation is not None:
+                escalation.close()
+            if verified is not None:
+                verified.close()
+
+        # chunks we never got to were abandoned along with the rest
+        counts[ABANDONED] += total - processed
+
+        # a deferred lane converges once everything below it in the run did
+        if counts[CONVERGED] + counts[DEFERRED] == total:
             results[coeff] = "All numbers converged"
         else:
-            num_looped = np.count_nonzero(result_arr == LOOP_DETECTED)
-            num_diverged = np.count_nonzero(result_arr == DIVERGED)
-            num_abandoned = np.count_nonzero(result_arr == ABANDONED)
-            num_overflows = np.count_nonzero(result_arr == OVERFLOW)
-            num_error = np.count_nonzero(result_arr == ERROR)
-            num_uninitialized = np.count_nonzero(result_arr == UNINITIALIZED)
+            results[coeff] = f"Failed - {counts[LOOP_DETECTED]} looped, {counts[DIVERGED]} diverged, {counts[OVERFLOW]} overflows, {counts[ABANDONED]} abandoned, {counts[ERROR]} error, {counts[UNINITIALIZED_STATUS]} uninitialized, {counts[DEFERRED]} deferred"
+
+        if cycle_hits:
+            registry.save()
+
+        if checkpoint is not None:
+            checkpoint.finish(key, results[coeff] == "All numbers converged", results[coeff])
+            checkpoint.save()
 
-            results[coeff] = f"Failed - {num_looped} looped, {num_diverged} diverged, {num_overflows} overflows, {num_abandoned} abandoned, {num_error} error, {num_uninitialized} uninitialized"
+        if witnesses is not None:
+            witnesses.save()
 
         print(f'[C_{coeff}] {results[coeff]}')
+        if escalated:
+            outcome = ', '.join(f'{count} {STATUS_NAMES[status]}' for status, count in sorted(escalated.items()))
+            print(f'[C_{coeff}] {sum(escalated.values())} lanes overflowed the kernel and were continued: {outcome}')
+        for minimum, count in sorted(cycle_hits.items()):
+            print(f'[C_{coeff}] {count} lanes fell into the cycle with minimal element {minimum}')
+        if witnesses is not None:
+            print_witnesses(coeff, witnesses.get(key))
         print(f'[C_{coeff}] took {time.time() - t1} seconds.')
 
         if coeff == 3 and results[coeff] != "All numbers converged":
@@ -214,44 +930,51 @@ def test_coefficients_gpu(coeffs, test_size, divergence_limit, ele_min, ele_max,
 
 
 # Use this function to debug individual elements with arbitrary precision on the CPU
-def _collatz(coefficient, n):
-    primes = list(sympy.sieve.primerange(coefficient))
-    last_log = int(math.log(n, 2))
-    largest_log = int(math.log(n, 2))
+def _collatz(coefficient, n, method=cycles.DEFAULT_DETECTOR, stats=None, engine=DEFAULT_BIGINT_ENGINE):
+    engine = bigint_engine(engine)
+    strip = engine.stripper(coefficient)
+    n = engine.convert(n)
+
+    first_n = n
+    # floor(log2(n)), from the bit length rather than a float log of a huge int
+    start_log = n.bit_length() - 1
+    last_log = start_log
+    largest_log = start_log
 
     did_double = 0
+    strip_steps = 0
+    multiplies = 0
+
+    def step(n):
+        # Remove primes smaller than coeff
+        return coefficient * strip(n)[0] + 1
 
-    seen = []
+    detector = cycles.detector(step, n, method)
 
     print(f'CPU Testing coefficient {coefficient}')
 
     while True:
-        seen.append(n)
-        
-        # Remove primes smaller than coeff
-        for p in primes:
-            
-            if p >= coefficient:
-                break
-
-            while n % p == 0:
-                n = n // p
+        n, stripped = strip(n)
+        if stripped:
+            strip_steps += 1
 
         if n == 1:
             break
 
         n = coefficient * n + 1
+        multiplies += 1
 
-        if n in seen:
-            print('Loop detected.')
+        if detector.update(n):
+            cycle = cycles.locate(step, first_n, detector.length)
+            print(f'Loop detected: cycle of length {cycle.length} entered at {cycle.entry} after {cycle.tail} steps.')
             raise Exception('LOOOOOOP')
-            break
 
-        if int(math.log(n, 2)) > largest_log:    
-            largest_log = int(math.log(n, 2))
+        log = n.bit_length() - 1
+        if log > largest_log:
+            largest_log = log
 
-        if int(math.log(n, 2)) >= last_log * 2: # x doubled in bits
-            last_log = int(math.log(n, 2))
+        if log >= last_log * 2: # x doubled in bits
+            last_log = log
             print(f'N doubled in bits to {last_log}')
             did_double += 1
             if did_double >= DOUBLE_LIMIT:
@@ -259,10 +982,13 @@ def _collatz(coefficient, n):
                 print(f'coefficient {coefficient} failed the Arbitrary precision CPU audit ')
                 return False
 
-        elif int(math.log(n, 2))<= last_log / 2 :  # x halved in bits
-            last_log = int(math.log(n, 2))
+        elif log <= last_log / 2 :  # x halved in bits
+            last_log = log
             print(f'N halved in bits to {last_log}')
 
+    if stats is not None:
+        stats.record(coefficient, Trajectory(start_log + 1, strip_steps + multiplies, largest_log + 1, strip_steps, multiplies))
+
     print(f'Done at {n}. Largest number of bits in reduction: {largest_log}')
     return True
 
@@ -270,14 +996,60 @@ def _collatz(coefficient, n):
 
 # perform the random tests!
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Test strong Collatz coefficients.')
+    parser.add_argument('--checkpoint', default='cuda.checkpoint.json',
+        help='Where to periodically save progress.')
+    parser.add_argument('--resume', action='store_true',
+        help='Continue from the last checkpoint instead of starting over.')
+    parser.add_argument('--registry', default=REGISTRY_PATH,
+        help='Where the known cycles are kept between runs.')
+    parser.add_argument('--stats', default=None,
+        help='Write per-trajectory histograms of the audit here as json.')
+    parser.add_argument('--witnesses', default=WITNESS_PATH,
+        help='Where to write a record of every lane that did not converge.')
+    parser.add_argument('--bitmap', default=None,
+        help='Directory to keep a memory-mapped verified bitmap per coefficient in for the serial tests.')
+    parser.add_argument('--wide', action='store_true',
+        help='Run the random tests on 2^60-2^100 inputs in 192-bit arithmetic.')
+    parser.add_argument('--engine', choices=list(BIGINT_ENGINES), default=DEFAULT_BIGINT_ENGINE,
+        help='Arbitrary precision engine for the CPU audit.')
+    parser.add_argument('--divergence-bits', type=int, default=None,
+        help='Divergence cap in bits. Lanes that outgrow the kernel below it are continued in Python ints.')
+    args = parser.parse_args()
+
+    divergence_cap = DIVERGENCE_CAP if args.divergence_bits is None else 2**args.divergence_bits
+    wide_divergence_cap = WIDE_DIVERGENCE_CAP if args.divergence_bits is None else 2**args.divergence_bits
+    engine = bigint_engine(args.engine).name
+
+    registry = CycleRegistry(args.registry)
+    registry.load()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    witnesses = Witnesses(args.witnesses)
+    if args.resume and checkpoint.load():
+        print(f'Resuming from {args.checkpoint}')
+        witnesses.load()
+
     coeffs = range(MIN_COEFFICIENT, MAX_COEFFICIENT + 1, 2)
     #coeffs = range(MIN_COEFFICIENT, MAX_COEFFICIENT + 1)
-    random_test_results = test_coefficients_gpu(coeffs, RANDOM_NUM_TESTS, DIVERGENCE_CAP, RANDOM_ELEMENT_MIN, RANDOM_ELEMENT_MAX, method='random')
-    random_sequence = [k for k,v in random_test_results.items() if v == 'All numbers converged']
-    print(f'Random Sequence Result: {random_sequence}')
+    try:
+        if args.wide:
+            random_test_results = test_coefficients_gpu(coeffs, RANDOM_NUM_TESTS, wide_divergence_cap, RANDOM_WIDE_ELEMENT_MIN, RANDOM_WIDE_ELEMENT_MAX, method='random', backend='wide', checkpoint=checkpoint, registry=registry, witnesses=witnesses)
+        else:
+            random_test_results = test_coefficients_gpu(coeffs, RANDOM_NUM_TESTS, divergence_cap, RANDOM_ELEMENT_MIN, RANDOM_ELEMENT_MAX, method='random', checkpoint=checkpoint, registry=registry, witnesses=witnesses)
+        random_sequence = [k for k,v in random_test_results.items() if v == 'All numbers converged']
+        print(f'Random Sequence Result: {random_sequence}')
+
+        # perform the serial tests on the first N integers
+        serial_test_results = test_coefficients_gpu(random_sequence, SERIAL_NUM_TESTS, divergence_cap, 1, None, method='serial', checkpoint=checkpoint, registry=registry, witnesses=witnesses, bitmap=args.bitmap)
+    except KeyboardInterrupt:
+        checkpoint.save()
+        witnesses.save()
+        print(f'Interrupted, progress saved to {args.checkpoint}. Rerun with --resume to continue.')
+        sys.exit(1)
 
-    # perform the serial tests on the first N integers
-    serial_test_results = test_coefficients_gpu(random_sequence, SERIAL_NUM_TESTS, DIVERGENCE_CAP, 1, None, method='serial')
     serial_sequence = [k for k,v in serial_test_results.items() if v == 'All numbers converged']
     print(f'Serial Sequence Result: {serial_sequence}')
 
@@ -285,14 +1057,19 @@ if __name__ == "__main__":
     audit_seq = sorted(list(set(random_sequence).intersection(serial_sequence)))
 
     final_seq = []
+    stats = Stats()
     for coeff in audit_seq:
         t1 = time.time()
         random_start = random.randint(RANDOM_CPU_ELEMENT_MIN, RANDOM_CPU_ELEMENT_MAX)
-        if _collatz(coeff, random_start):
+        if _collatz(coeff, random_start, stats=stats, engine=engine):
             final_seq.append(coeff)
         print(f'[C_{coeff}] took {time.time() - t1} seconds.')
 
 
+    stats.summary()
+    if args.stats:
+        stats.save(args.stats)
+
     print(f'Coeffs random: {random_sequence}')
     print(f'Coeffs in serial: {serial_sequence}')
     print(f'Coeffs that passed the audit: {final_seq}')
@@ -0,0 +1,158 @@
+from collections import deque, namedtuple
+
+
+# which detector the reduction functions use unless told otherwise
+DEFAULT_DETECTOR = 'brent'
+
+# how many recent fingerprints the hash detector remembers
+HASH_WINDOW = 4096
+
+
+# length: the number of elements in the cycle
+# entry: the first element of the cycle the trajectory reaches
+# tail: how many steps it takes to reach entry from the start
+Cycle = namedtuple('Cycle', ['length', 'entry', 'tail'])
+
+
+# All detectors are fed the trajectory one value at a time through update(x),
+# where x is the next value after the start x0. update returns True once a
+# cycle has been found, at which point self.length holds its length.
+# f must be the pure step function that produced the trajectory, the detectors
+# use it to measure the cycle and the second pass uses it to find the entry.
+
+class BrentDetector:
+
+    def __init__(self, f, x0):
+        self.f = f
+        self.power = 1
+        self.lam = 1
+        self.saved = x0
+        self.length = None
+
+    def update(self, x):
+        if x == self.saved:
+            self.length = self.lam
+            return True
+
+        if self.power == self.lam:
+            self.saved = x
+            self.power *= 2
+            self.lam = 0
+
+        self.lam += 1
+        return False
+
+
+class FloydDetector:
+
+    def __init__(self, f, x0):
+        self.f = f
+        self.turtle = x0
+        self.i = 0
+        self.length = None
+
+    def update(self, x):
+        self.i += 1
+        if self.i % 2 != 0:
+            return False
+
+        # the turtle moves at half the speed of the trajectory
+        self.turtle = self.f(self.turtle)
+        if x != self.turtle:
+            return False
+
+        self.length = cycle_length(self.f, x)
+        return True
+
+
+# Remembers fingerprints of the last HASH_WINDOW values, so a short cycle is caught
+# the first time a value repeats. Fingerprints can collide, so every hit is confirmed
+# by walking the candidate cycle. Cycles longer than the window fall through to Brent.
+class HashDetector:
+
+    def __init__(self, f, x0, window=HASH_WINDOW):
+        self.f = f
+        self.window = window
+        self.brent = BrentDetector(f, x0)
+        self.recent = {hash(x0): 0}
+        self.order = deque([(hash(x0), 0)])
+        self.i = 0
+        self.length = None
+
+    def update(self, x):
+        self.i += 1
+
+        if self.brent.update(x):
+            self.length = self.brent.length
+            return True
+
+        fingerprint = hash(x)
+        j = self.recent.get(fingerprint)
+        if j is not None:
+            length = cycle_length(self.f, x, limit=self.i - j)
+            if length is not None:
+                self.length = length
+                return True
+
+        self.recent[fingerprint] = self.i
+        self.order.append((fingerprint, self.i))
+        if len(self.order) > self.window:
+            old_fingerprint, old_i = self.order.popleft()
+            if self.recent.get(old_fingerprint) == old_i:
+                del self.recent[old_fingerprint]
+
+        return False
+
+
+DETECTORS = {
+    'brent': BrentDetector,
+    'floyd': FloydDetector,
+    'hash': HashDetector,
+}
+
+
+def detector(f, x0, method=DEFAULT_DETECTOR):
+    if method not in DETECTORS:
+        raise Exception(f'Unknown cycle detector {method}')
+    return DETECTORS[method](f, x0)
+
+
+# The number of steps for x to come back to itself, or None if it doesn't within limit
+def cycle_length(f, x, limit=None):
+    y = f(x)
+    length = 1
+    while y != x:
+        if limit is not None and length >= limit:
+            return None
+        y = f(y)
+        length += 1
+    return length
+
+
+# Second pass: given the cycle length, walk two pointers that far apart from x0
+# until they meet at the first element of the cycle.
+def locate(f, x0, length):
+    lead = x0
+    for _ in range(length):
+        lead = f(lead)
+
+    trail = x0
+    tail = 0
+    while trail != lead:
+        trail = f(trail)
+        lead = f(lead)
+        tail += 1
+
+    return Cycle(length, trail, tail)
+
+
+# Iterate f from x0 until stop(x) is true or a cycle is found.
+# Returns None when the trajectory stopped, otherwise the Cycle.
+def find_cycle(f, x0, stop, method=DEFAULT_DETECTOR):
+    d = detector(f, x0, method)
+    x = x0
+    while not stop(x):
+        x = f(x)
+        if d.update(x):
+            return locate(f, x0, d.length)
+    return None
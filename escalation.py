@@ -0,0 +1,97 @@
+import multiprocessing
+from multiprocessing import cpu_count
+
+import cycles
+from registry import kernel_step
+
+
+# the same result codes collatz_cuda writes into result_arr
+CONVERGED = 1
+DIVERGED = 2
+LOOP_DETECTED = 3
+
+# how many escalated lanes a worker takes at a time
+ESCALATION_CHUNK_SIZE = 4
+
+# Workers are started fresh rather than forked: the kernels' threading layer
+# doesn't survive a fork, and the parent hangs on exit if it tries.
+START_METHOD = 'spawn'
+
+
+# Tiered execution for the fixed-width kernels. A lane that overflows its kernel's
+# width (64 or 192 bits) leaves behind the last value it reached that still fit and
+# how many steps it took to get there. Instead of abandoning the batch, those lanes
+# are continued here in Python ints, on a pool of worker processes, while the
+# kernel gets on with the next chunk. Their verdicts then replace the OVERFLOW the
+# kernel wrote.
+
+
+# Carry a lane on from n, which it reached after `steps` steps, until it reaches 1,
+# passes divergence_limit or loops. Returns the status, the total steps, the bit
+# length of the largest value on the way, and where it stopped (for a loop, the
+# first element of the cycle it entered).
+def continue_lane(coeff, n, steps, divergence_limit):
+    step = lambda x: kernel_step(coeff, x)
+    detector = cycles.detector(step, n)
+
+    x = n
+    peak_bits = n.bit_length()
+    while x != 1:
+        x = step(x)
+        steps += 1
+        peak_bits = max(peak_bits, x.bit_length())
+        if x > divergence_limit:
+            return DIVERGED, steps, peak_bits, x
+        if detector.update(x):
+            return LOOP_DETECTED, steps, peak_bits, cycles.locate(step, n, detector.length).entry
+
+    return CONVERGED, steps, peak_bits, x
+
+
+# worker side: lanes are (position, value, steps), results (position, status, steps, peak bits, value)
+def continue_lanes(coeff, divergence_limit, lanes):
+    return [(position, *continue_lane(coeff, n, steps, divergence_limit)) for position, n, steps in lanes]
+
+
+# The continuation pool for one coefficient. submit() hands over a chunk's
+# overflowed lanes and returns straight away; done() collects the lanes that have
+# finished since the last call (all of them with wait=True). The pool is only
+# started once something overflows.
+class Escalation:
+
+    def __init__(self, coeff, divergence_limit, nworkers=None, chunk_size=ESCALATION_CHUNK_SIZE):
+        self.coeff = coeff
+        self.divergence_limit = int(divergence_limit)
+        self.nworkers = nworkers or cpu_count()
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.pending = []
+        self.submitted = 0
+
+    def submit(self, lanes):
+        if not lanes:
+            return
+        if self.pool is None:
+            self.pool = multiprocessing.get_context(START_METHOD).Pool(processes=self.nworkers)
+        for lo in range(0, len(lanes), self.chunk_size):
+            self.pending.append(self.pool.apply_async(continue_lanes, (self.coeff, self.divergence_limit, lanes[lo:lo + self.chunk_size])))
+        self.submitted += len(lanes)
+
+    def done(self, wait=False):
+        finished = []
+        pending = []
+        for result in self.pending:
+            if wait or result.ready():
+                finished.extend(result.get())
+            else:
+                pending.append(result)
+        self.pending = pending
+        return finished
+
+    # drop anything still running
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending = []
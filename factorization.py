@@ -0,0 +1,232 @@
+import os
+import math
+import functools
+import numpy as np
+import sympy
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+# values up to this are factored from the sieve, 4 bytes an entry
+SIEVE_BOUND = 2**24
+
+# factorizations of values past the sieve kept around, least recently used dropped
+CACHE_SIZE = 2**16
+
+# values past the sieve are trial divided by the primes below this before rho
+TRIAL_BOUND = 2**16
+
+# most values have a factor below this, which a gcd against a much shorter
+# product finds first
+SMALL_TRIAL_BOUND = 2**8
+
+# Pollard rho steps between gcds
+RHO_BATCH = 128
+
+
+# smallest prime factor of every integer up to bound, spf[p] == p for a prime
+# (spf[0] and spf[1] are 0)
+def spf_sieve(bound):
+    spf = np.zeros(bound + 1, dtype=np.uint32)
+    for p in range(2, int(bound**0.5) + 1):
+        if spf[p] == 0:
+            multiples = spf[p*p::p]
+            multiples[multiples == 0] = p
+    primes = np.flatnonzero(spf == 0)
+    spf[primes] = primes
+    spf[:2] = 0
+    return spf
+
+
+# A non-trivial factor of an odd composite n, by Brent's variant of Pollard rho with
+# the gcds batched. Gives up on a polynomial that cycles without splitting n and
+# tries the next one. Runs on mpz when gmpy2 is installed.
+def pollard_rho(n, c=1):
+    if gmpy2 is not None:
+        n = gmpy2.mpz(n)
+    while True:
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y*y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(RHO_BATCH, r - k)):
+                    y = (y*y + c) % n
+                    q = q * (x - y) % n
+                g = math.gcd(q, n)
+                k += RHO_BATCH
+            r *= 2
+        # the batch overshot, walk it again one gcd at a time
+        if g == n:
+            g = 1
+            while g == 1:
+                ys = (ys*ys + c) % n
+                g = math.gcd(x - ys, n)
+        if g != n:
+            return int(g)
+        c += 1
+
+
+# Factorization for the primality.py reduce funcs, which ask for the factors of the
+# same small values over and over. Anything up to the bound is factored by walking
+# a smallest-prime-factor sieve, O(log n) with no division to speak of, and is
+# prime when it is its own smallest factor. Values past the bound go to sympy, with
+# the factorizations kept in an LRU cache.
+#
+# Most reduce funcs only need the smallest or the largest prime factor, which
+# smallest_factor() and largest_factor() find without factoring the rest of x
+# past the sieve: the primes below TRIAL_BOUND are split off with a gcd against
+# their product, and what is left is split by Pollard rho only as far as it takes.
+#
+# With a path the sieve is kept on disk and memory-mapped on load, so it is built
+# once and shared by every process that opens it.
+class Factorizer:
+
+    def __init__(self, bound=SIEVE_BOUND, path=None, cache_size=CACHE_SIZE):
+        self.bound = bound
+        self.path = path
+        self.spf = None
+        self.trial_primes = None
+        self.trial_limit = None
+        self.trial_product = None
+        self.small_product = None
+        self._factor_large = functools.lru_cache(maxsize=cache_size)(self._factorint)
+        self._smallest_large = functools.lru_cache(maxsize=cache_size)(self._smallest_factor)
+        self._largest_large = functools.lru_cache(maxsize=cache_size)(self._largest_factor)
+
+    # returns False when there is nothing to load, or the saved sieve is too short
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        spf = np.load(self.path, mmap_mode='r')
+        if spf.size <= self.bound:
+            return False
+        self.spf = spf
+        return True
+
+    # write to a temporary file and swap it in, like Checkpoint.save
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.spf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # load the sieve if it was saved, otherwise build it (and save it if there's a path)
+    def build(self):
+        if not self.load():
+            self.spf = spf_sieve(self.bound)
+            if self.path is not None:
+                self.save()
+                self.load()
+        self.trial_limit = min(TRIAL_BOUND, self.bound + 1)
+        trial = np.arange(self.trial_limit)
+        self.trial_primes = [int(p) for p in trial[self.spf[trial] == trial][1:]]
+        self.trial_product = math.prod(self.trial_primes)
+        self.small_product = math.prod(p for p in self.trial_primes if p < SMALL_TRIAL_BOUND)
+        return self
+
+    def _factorint(self, x):
+        retval = []
+        for k, v in sorted(sympy.ntheory.factorint(x).items()):
+            retval += [k] * v
+        return tuple(retval)
+
+    def isprime(self, x):
+        if x <= self.bound:
+            return x >= 2 and self.spf[x] == x
+        return sympy.ntheory.isprime(x)
+
+    # prime factors in ascending order, with multiplicity
+    def factor(self, x):
+        if x > self.bound:
+            return list(self._factor_large(x))
+        retval = []
+        while x > 1:
+            p = int(self.spf[x])
+            retval.append(p)
+            x //= p
+        return retval
+
+    # x split into the part made of the trial primes and the part with none of them
+    def _trial_split(self, x):
+        smooth = 1
+        g = math.gcd(x, self.trial_product)
+        while g > 1:
+            x //= g
+            smooth *= g
+            g = math.gcd(x, g)
+        return smooth, x
+
+    # The smallest and largest prime factor of a rough x, one with no trial prime in
+    # it, or None when there is none below `below` (above `above`). Every prime in x
+    # is at least trial_limit, so x under trial_limit^2 is prime, and a composite x
+    # under trial_limit^3 is the product of the two primes rho splits it into.
+    # Otherwise the halves are searched in turn, with the best so far as the cutoff,
+    # and a half is only split when it can still hold a better prime: a prime half
+    # past the cutoff is dropped once it is proven prime, and for the largest factor
+    # a half no bigger than the cutoff is dropped outright. The cofactor is never
+    # factored further than that.
+    def _rough_smallest(self, x, below=None):
+        if x < self.trial_limit**2 or self.isprime(x):
+            return x if below is None or x < below else None
+        d = pollard_rho(x)
+        a, b = sorted((d, x // d))
+        if x < self.trial_limit**3:
+            return a if below is None or a < below else None
+        p = self._rough_smallest(a, below)
+        q = self._rough_smallest(b, below if p is None else p)
+        return p if q is None else q
+
+    def _rough_largest(self, x, above=None):
+        if x < self.trial_limit**2 or self.isprime(x):
+            return x if above is None or x > above else None
+        d = pollard_rho(x)
+        a, b = sorted((d, x // d))
+        if x < self.trial_limit**3:
+            return b if above is None or b > above else None
+        q = self._rough_largest(b, above)
+        if q is not None:
+            above = q
+        if above is not None and a <= above:
+            return q
+        p = self._rough_largest(a, above)
+        return q if p is None else p
+
+    def _smallest_factor(self, x):
+        g = math.gcd(x, self.small_product)
+        if g > 1:
+            return int(self.spf[g]) if g <= self.bound else next(p for p in self.trial_primes if g % p == 0)
+        smooth, rough = self._trial_split(x)
+        if smooth == 1:
+            return self._rough_smallest(rough)
+        if smooth <= self.bound:
+            return int(self.spf[smooth])
+        return next(p for p in self.trial_primes if smooth % p == 0)
+
+    def _largest_factor(self, x):
+        smooth, rough = self._trial_split(x)
+        if rough > 1:
+            return self._rough_largest(rough)
+        if smooth <= self.bound:
+            return self.factor(smooth)[-1]
+        return next(p for p in reversed(self.trial_primes) if smooth % p == 0)
+
+    # the smallest prime factor of x > 1
+    def smallest_factor(self, x):
+        if x <= self.bound:
+            return int(self.spf[x])
+        return self._smallest_large(x)
+
+    # the largest prime factor of x > 1
+    def largest_factor(self, x):
+        if x <= self.bound:
+            return self.factor(x)[-1]
+        return self._largest_large(x)
@@ -0,0 +1,205 @@
+from collections import namedtuple
+import functools
+import numpy as np
+from numba import njit, prange, uint64
+
+from wide import add128_64, mul128_64, shr128
+
+
+# k for the jump tables unless told otherwise, 2^16 entries
+DEFAULT_K = 16
+
+U64_MAX = 2**64 - 1
+
+# the same result codes collatz_cuda writes into result_arr
+UNINITIALIZED = 4294967295
+CONVERGED = 1
+LOOP_DETECTED = 3
+OVERFLOW = 5
+
+
+# k-step jumps for the shortcut map T(n) = n/2 (n even), (c*n + 1)/2 (n odd).
+#
+# Writing n = a*2^k + b with b < 2^k, the first k steps of n have the same parities
+# as the first k steps of b, and
+#
+#     T^k(n) = c^j * a + T^k(b)
+#
+# where j is how many of those steps were odd. So one lookup on b = n mod 2^k gives
+# the multiplier, the additive term and the step counts for k steps at once.
+#
+# A jump never skips over 1: for n > 2^k every value in the next k steps is at
+# least n/2^k > 1. Below that the engines take single steps.
+#
+# For the weak map W(n) = n/2, c*n + 1 every odd shortcut step is two raw steps,
+# so a jump is k + j raw steps.
+
+# Python-int table: odd[b] = j, add[b] = T^k(b), parity[b] has bit i set when
+# step i was odd, powers[j] = c^j
+JumpTable = namedtuple('JumpTable', ['coeff', 'k', 'odd', 'add', 'parity', 'powers'])
+
+# the same thing as uint64 arrays for the numba kernels, plus limit[b], the largest
+# a that can be jumped without overflowing 64 bits
+JumpArrays = namedtuple('JumpArrays', ['coeff', 'k', 'odd', 'add', 'limit', 'powers'])
+
+
+@functools.lru_cache
+def jump_table(coeff, k=DEFAULT_K):
+    if coeff % 2 == 0:
+        raise Exception('Jump tables are only defined for odd coefficients')
+
+    odd = []
+    add = []
+    parity = []
+    for b in range(2**k):
+        x = b
+        j = 0
+        bits = 0
+        for i in range(k):
+            if x % 2 == 0:
+                x = x // 2
+            else:
+                x = (coeff * x + 1) // 2
+                j += 1
+                bits |= 1 << i
+        odd.append(j)
+        add.append(x)
+        parity.append(bits)
+
+    powers = [coeff**j for j in range(k + 1)]
+    return JumpTable(coeff, k, odd, add, parity, powers)
+
+
+@functools.lru_cache
+def jump_arrays(coeff, k=DEFAULT_K):
+    table = jump_table(coeff, k)
+
+    if max(table.add) > U64_MAX or table.powers[-1] > U64_MAX:
+        raise Exception(f'C_{coeff} with k={k} does not fit a 64-bit jump table, use a smaller k')
+
+    limit = [(U64_MAX - d) // table.powers[j] for j, d in zip(table.odd, table.add)]
+
+    return JumpArrays(
+        uint64(coeff),
+        k,
+        np.array(table.odd, dtype=np.uint64),
+        np.array(table.add, dtype=np.uint64),
+        np.array(limit, dtype=np.uint64),
+        np.array(table.powers, dtype=np.uint64),
+    )
+
+
+# One move of the Python-int engine: k steps if n is big enough, otherwise one.
+# Returns the new value, the shortcut steps taken, the odd steps among them,
+# and the parity bits of those steps.
+def advance(n, table):
+    if n > 1 << table.k:
+        b = n & ((1 << table.k) - 1)
+        j = table.odd[b]
+        return table.powers[j] * (n >> table.k) + table.add[b], table.k, j, table.parity[b]
+
+    if n % 2 == 0:
+        return n // 2, 1, 0, 0
+    return (table.coeff * n + 1) // 2, 1, 1, 1
+
+
+# The number of steps for n to reach 1, in shortcut steps or in raw weak steps.
+# Doesn't look for cycles, only use it where every trajectory reaches 1.
+def stopping_time(n, table, weak=False):
+    steps = 0
+    while n != 1:
+        n, k, j, _ = advance(n, table)
+        steps += k + j if weak else k
+    return steps
+
+
+# One move of the 64-bit engine. Returns the new value, the shortcut steps, the
+# odd steps and whether it would have overflowed (in which case n is unchanged).
+@njit(nogil=True)
+def advance_u64(n, table):
+    n = uint64(n)
+    k = uint64(table.k)
+
+    if n > uint64(1) << k:
+        a = n >> k
+        b = n & ((uint64(1) << k) - uint64(1))
+        if a > table.limit[b]:
+            return n, uint64(0), uint64(0), True
+        j = table.odd[b]
+        return table.powers[j] * a + table.add[b], k, j, False
+
+    if n & uint64(1) == 0:
+        return n >> uint64(1), uint64(1), uint64(0), False
+    return (table.coeff * n + uint64(1)) >> uint64(1), uint64(1), uint64(1), False
+
+
+# One move of the 128-bit engine, n = (hi, lo). Returns the new (hi, lo), the
+# shortcut steps, the odd steps and whether it overflowed 128 bits.
+@njit(nogil=True)
+def advance_u128(hi, lo, table):
+    k = uint64(table.k)
+    mask = (uint64(1) << k) - uint64(1)
+
+    if hi != 0 or lo > uint64(1) << k:
+        a_hi, a_lo = shr128(hi, lo, k)
+        b = lo & mask
+        j = table.odd[b]
+        p_hi, p_lo, overflow = mul128_64(a_hi, a_lo, table.powers[j])
+        new_hi, new_lo, carry = add128_64(p_hi, p_lo, table.add[b])
+        if overflow or carry:
+            return hi, lo, uint64(0), uint64(0), True
+        return new_hi, new_lo, k, j, False
+
+    # small enough to fit a single limb
+    if lo & uint64(1) == 0:
+        return uint64(0), lo >> uint64(1), uint64(1), uint64(0), False
+    p_hi, p_lo, overflow = mul128_64(uint64(0), lo, table.coeff)
+    p_hi, p_lo, carry = add128_64(p_hi, p_lo, uint64(1))
+    p_hi, p_lo = shr128(p_hi, p_lo, uint64(1))
+    return p_hi, p_lo, uint64(1), uint64(1), False
+
+
+# Reduce every lane with turtle/hare on the jumped map, in 128-bit arithmetic.
+# results gets CONVERGED, LOOP_DETECTED or OVERFLOW, steps the number of steps to 1
+# (raw weak steps if weak, shortcut steps otherwise) for the lanes that converged.
+@njit(parallel=True, nogil=True)
+def collatz_jump_cpu(n_arr, table, results, steps, weak):
+
+    for idx in prange(n_arr.size):
+
+        t_hi = uint64(0)
+        t_lo = uint64(n_arr[idx])
+        h_hi = t_hi
+        h_lo = t_lo
+        hare_steps = uint64(0)
+        result = UNINITIALIZED
+
+        if t_lo == 1:
+            result = CONVERGED
+
+        while result == UNINITIALIZED:
+
+            t_hi, t_lo, k, j, overflow = advance_u128(t_hi, t_lo, table)
+            if overflow:
+                result = OVERFLOW
+                break
+
+            for _ in range(2):
+                h_hi, h_lo, k, j, overflow = advance_u128(h_hi, h_lo, table)
+                if overflow:
+                    result = OVERFLOW
+                    break
+                hare_steps += k + j if weak else k
+                if h_hi == 0 and h_lo == 1:
+                    result = CONVERGED
+                    break
+
+            if result != UNINITIALIZED:
+                break
+
+            if t_hi == h_hi and t_lo == h_lo:
+                result = LOOP_DETECTED
+
+        results[idx] = result
+        if result == CONVERGED:
+            steps[idx] = hare_steps
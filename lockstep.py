@@ -0,0 +1,183 @@
+import sys
+import time
+import numpy as np
+from strip import strip_table, strip_lanes
+from registry import known_cycles
+
+
+# the cap to stop evaluating due to explosion
+DIVERGENCE_CAP = np.uint64(2**62)
+
+# the same result codes collatz_cuda writes into result_arr
+UNINITIALIZED = 4294967295
+CONTINUE = 0
+CONVERGED = 1
+DIVERGED = 2
+LOOP_DETECTED = 3
+ABANDONED = 4
+OVERFLOW = 5
+ERROR = 6
+
+U64_MAX = np.uint64(2**64 - 1)
+
+
+# Vectorized analogue of cuda.collatz_reduce: one strong step for every lane at once.
+# Returns the per-lane status and the reduced values.
+def lockstep_reduce(n, coeff, divergence_limit, table):
+
+    coeff = np.uint64(coeff)
+
+    # Remove primes smaller than coeff
+    n, stripped = strip_lanes(n, table)
+
+    status = np.full(n.shape, CONTINUE, dtype=np.uint8)
+
+    converged = n == 1
+    status[converged] = CONVERGED
+
+    # lanes that had nothing stripped take the coeff * n + 1 step
+    multiply = ~(stripped | converged)
+
+    # anything past this would wrap around in uint64
+    overflow = multiply & (n > (U64_MAX - np.uint64(1)) // coeff)
+    status[overflow] = OVERFLOW
+    multiply &= ~overflow
+
+    n[multiply] = coeff * n[multiply] + np.uint64(1)
+
+    diverged = multiply & (n > divergence_limit)
+    status[diverged] = DIVERGED
+
+    return status, n
+
+
+# Reduce every element of n_arr under C_coeff in lockstep, returning an array of
+# the same result codes collatz_cuda produces. Each lane keeps a turtle (one step)
+# and a hare (two steps); lanes drop out of the active set as soon as they resolve.
+#
+# stop_on_failure mirrors the status_flag early-abandon of collatz_cuda: once any
+# lane loops or overflows, every lane still running is marked ABANDONED.
+#
+# With a registry, a hare landing on a known cycle is a loop straight away, and
+# hits (if given) gets the minimal element of the cycle each lane fell into.
+#
+# values, steps and peaks (if given) get where each lane that didn't converge
+# stopped, the steps it took to get there and the largest value before it, the
+# same as cuda.collatz_lane_cpu reports them.
+def collatz_lockstep(n_arr, coeff, divergence_limit=DIVERGENCE_CAP, stop_on_failure=True, max_steps=None, registry=None, hits=None, values=None, steps=None, peaks=None):
+
+    n_arr = np.asarray(n_arr, dtype=np.uint64)
+    divergence_limit = np.uint64(divergence_limit)
+
+    table = strip_table(coeff)
+
+    if registry is not None:
+        members, owners = registry.members(coeff)
+    else:
+        members = owners = np.zeros(0, dtype=np.uint64)
+
+    results = np.full(n_arr.shape, UNINITIALIZED, dtype=np.uint64)
+
+    # zero never reduces, don't let it spin forever
+    zero = n_arr == 0
+    results[zero] = ERROR
+
+    lanes = np.flatnonzero(~zero)
+    turtle = n_arr[lanes]
+    hare = turtle.copy()
+    peak = turtle.copy()
+
+    iterations = 0
+    while lanes.size > 0:
+
+        # the hare has taken 2 * iterations steps
+        hare_steps = np.uint64(2 * iterations)
+
+        status1, new_turtle = lockstep_reduce(turtle, coeff, divergence_limit, table)
+        status2, mid = lockstep_reduce(hare, coeff, divergence_limit, table)
+        mid_cycle = known_cycles(mid, members, owners)
+        status3, new_hare = lockstep_reduce(mid, coeff, divergence_limit, table)
+        cycle = np.where(mid_cycle != 0, mid_cycle, known_cycles(new_hare, members, owners))
+
+        result = np.full(lanes.shape, CONTINUE, dtype=np.uint64)
+
+        # the order here matches collatz_cuda: converged beats diverged beats overflow beats loop
+        looped = (new_turtle == new_hare) | (cycle != 0)
+        result[looped] = LOOP_DETECTED
+
+        overflowed = (status1 == OVERFLOW) | (status2 == OVERFLOW) | (status3 == OVERFLOW)
+        result[overflowed] = OVERFLOW
+
+        diverged = (status1 == DIVERGED) | (status2 == DIVERGED) | (status3 == DIVERGED)
+        result[diverged] = DIVERGED
+
+        converged = (status1 == CONVERGED) | (status2 == CONVERGED) | (status3 == CONVERGED)
+        result[converged] = CONVERGED
+
+        done = result != CONTINUE
+        results[lanes[done]] = result[done]
+        if hits is not None:
+            hits[lanes[done]] = cycle[done]
+
+        # the hare's values count towards the peak unless the step failed
+        stepped = (result == CONTINUE) | (result == LOOP_DETECTED)
+        peak = np.where(stepped, np.maximum(np.maximum(peak, mid), new_hare), peak)
+
+        if values is not None:
+            one = np.uint64(1)
+
+            # a loop stops on the hare, on its first step if that is where it met a
+            # known cycle
+            value = np.where(mid_cycle != 0, mid, new_hare)
+            lane_steps = np.where(mid_cycle != 0, hare_steps + one, hare_steps + one + one)
+
+            # a divergence on the first value past the limit, the hare's if it got
+            # there first
+            div = result == DIVERGED
+            div_mid = div & (status2 == DIVERGED)
+            div_hare = div & ~div_mid & (status3 == DIVERGED)
+            div_turtle = div & ~div_mid & ~div_hare
+            value = np.select([div_mid, div_hare, div_turtle], [mid, new_hare, new_turtle], value)
+            lane_steps = np.select([div_mid, div_hare, div_turtle], [hare_steps + one, hare_steps + one + one, np.full_like(lane_steps, iterations + 1)], lane_steps)
+
+            # an overflow on the last value that fit, which lockstep_reduce leaves in place
+            over = result == OVERFLOW
+            over_hare = over & (status2 == OVERFLOW)
+            over_mid = over & ~over_hare & (status3 == OVERFLOW)
+            over_turtle = over & ~over_hare & ~over_mid
+            value = np.select([over_hare, over_mid, over_turtle], [hare, mid, turtle], value)
+            lane_steps = np.select([over_hare, over_mid, over_turtle], [np.full_like(lane_steps, hare_steps), hare_steps + one, np.full_like(lane_steps, iterations)], lane_steps)
+
+            report = done & (result != CONVERGED)
+            values[lanes[report]] = value[report]
+            steps[lanes[report]] = lane_steps[report]
+            peaks[lanes[report]] = peak[report]
+
+        running = ~done
+        lanes = lanes[running]
+        turtle = new_turtle[running]
+        hare = new_hare[running]
+        peak = peak[running]
+
+        iterations += 1
+        failed = np.any((result == LOOP_DETECTED) | (result == OVERFLOW))
+        if (stop_on_failure and failed) or (max_steps is not None and iterations >= max_steps):
+            results[lanes] = ABANDONED
+            break
+
+    return results
+
+
+# perform a serial test on the CPU
+if __name__ == "__main__":
+
+    COEFFICIENT = int(sys.argv[1])
+    SERIAL_MAX = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+
+    t1 = time.time()
+    n_arr = np.arange(1, SERIAL_MAX, dtype=np.uint64)
+    result_arr = collatz_lockstep(n_arr, COEFFICIENT)
+
+    counts = {code: np.count_nonzero(result_arr == code) for code in (CONVERGED, DIVERGED, LOOP_DETECTED, ABANDONED, OVERFLOW, ERROR)}
+    print(f'[C_{COEFFICIENT}] {counts[CONVERGED]} converged, {counts[LOOP_DETECTED]} looped, {counts[DIVERGED]} diverged, {counts[OVERFLOW]} overflows, {counts[ABANDONED]} abandoned, {counts[ERROR]} error')
+    print(f'[C_{COEFFICIENT}] took {time.time() - t1} seconds.')
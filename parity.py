@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# A parity sequence packed into a Python int. Position i of the sequence is bit i
+# of bits, and its string form is the old '0'/'1' parity string, position 0 first.
+class ParityVector:
+
+    __slots__ = ('bits', 'length')
+
+    def __init__(self, bits=0, length=0):
+        self.bits = bits
+        self.length = length
+
+    @classmethod
+    def from_string(cls, s):
+        return cls(int(s[::-1], 2) if s else 0, len(s))
+
+    # from a NumPy array of 0/1 values, packed in C rather than bit by bit
+    @classmethod
+    def from_array(cls, arr):
+        arr = np.asarray(arr, dtype=np.uint8)
+        packed = np.packbits(arr, bitorder='little')
+        return cls(int.from_bytes(packed.tobytes(), 'little'), arr.size)
+
+    def to_array(self):
+        packed = np.frombuffer(self.bits.to_bytes((self.length + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(packed, count=self.length, bitorder='little')
+
+    def mask(self):
+        return (1 << self.length) - 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                return ParityVector.from_array(self.to_array()[i])
+            length = max(0, stop - start)
+            return ParityVector((self.bits >> start) & ((1 << length) - 1), length)
+
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('parity vector index out of range')
+        return (self.bits >> i) & 1
+
+    def __iter__(self):
+        bits = self.bits
+        for _ in range(self.length):
+            yield bits & 1
+            bits >>= 1
+
+    def __add__(self, other):
+        return ParityVector(self.bits | (other.bits << self.length), self.length + other.length)
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return str(self) == other
+        return isinstance(other, ParityVector) and self.length == other.length and self.bits == other.bits
+
+    def __hash__(self):
+        return hash((self.bits, self.length))
+
+    def __str__(self):
+        return format(self.bits, '0{}b'.format(self.length))[::-1] if self.length else ''
+
+    def __repr__(self):
+        return "ParityVector('{}')".format(self)
+
+    def append(self, bit):
+        self.bits |= bit << self.length
+        self.length += 1
+
+    # a new vector with one more bit, leaving this one alone
+    def with_bit(self, bit):
+        return ParityVector(self.bits | (bit << self.length), self.length + 1)
+
+    def rotate(self, n):
+        if self.length == 0:
+            return ParityVector()
+        n = n % self.length
+        low = self.bits & ((1 << n) - 1)
+        return ParityVector((self.bits >> n) | (low << (self.length - n)), self.length)
+
+    def invert(self):
+        return ParityVector(self.bits ^ self.mask(), self.length)
+
+    def reverse(self):
+        if self.length == 0:
+            return ParityVector()
+        return ParityVector(int(format(self.bits, '0{}b'.format(self.length))[::-1], 2), self.length)
+
+
+# bit c of every vector, in order
+def column(vectors, c):
+    return ParityVector.from_array([v[c] for v in vectors])
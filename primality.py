@@ -4,17 +4,35 @@ import sympy
 import numpy
 import random
 import pprint
+import heapq
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+import cycles
+from factorization import Factorizer, SIEVE_BOUND
+from successors import SuccessorGraph, GRAPH_BOUND
 
 
+# the factorization service behind factor() and isprime(), built on first use
+# unless main() sets one up
+factorizer = None
+
+def get_factorizer():
+    global factorizer
+    if factorizer is None:
+        factorizer = Factorizer().build()
+    return factorizer
+
 def factor(x):
-    factor_dict = sympy.ntheory.factorint(x)
+    return get_factorizer().factor(x)
 
-    retval = []
+def isprime(x):
+    return get_factorizer().isprime(x)
 
-    for k,v in factor_dict.items():
-        retval += ([k]*v)
+def smallest_factor(x):
+    return get_factorizer().smallest_factor(x)
 
-    return retval
+def largest_factor(x):
+    return get_factorizer().largest_factor(x)
 
 def prod(mylist):
     tot = 1
@@ -31,120 +49,216 @@ def reduce_func_collatz(x):
 
 # works
 def reduce_func_squarep_and_largest_factor(x):
-    if sympy.ntheory.isprime(x):
+    if isprime(x):
         return ((x*x) + 1)
     else:
-        factors = factor(x)
-        return prod(factors[:-1])
+        return x // largest_factor(x)
 
 # also works -- closely mirrors collatz conjecture
 def reduce_func_poly_and_smallest_factor(x):
-    if sympy.ntheory.isprime(x):
+    if isprime(x):
         return ((2*x) + 1)
     else:
-        factors = factor(x)
-        return prod(factors[1:])
+        return x // smallest_factor(x)
 
 # (X^2+1) does not work, which makes (X^2-1) so interesting
 def reduce_func_squarep_and_smallest_factor(x):
-    if sympy.ntheory.isprime(x):
+    if isprime(x):
         return ((x*x) + 1)
     else:
-        factors = factor(x)
-        return prod(factors[1:])
+        return x // smallest_factor(x)
 
 # works! -- this is awesome
 def reduce_func_sqarem_and_smallest_factor(x):
-    if sympy.ntheory.isprime(x):
+    if isprime(x):
         res = ((x*x) - 1)
         return int(res)
     else:
-        factors = factor(x)
-        return prod(factors[1:])
+        return x // smallest_factor(x)
 
 # this is not interesting, as the result of the totient function
 # is always even
 # ... but we're just throwing stuff at the wall
 def reduce_func6(x):
-    if sympy.ntheory.isprime(x):
+    if isprime(x):
         return ((x*x) - 1)
     else:
         return sympy.ntheory.totient(x)
 
-def reduce(x, reduce_func=reduce_func_sqarem_and_smallest_factor):
+# a looping path ends with the first repeated element, the entry of the cycle
+def reduce(x, reduce_func=reduce_func_sqarem_and_smallest_factor, method=cycles.DEFAULT_DETECTOR):
     path = []
+    detector = cycles.detector(reduce_func, x, method)
     while x != 2:
         path.append(x)
         x = reduce_func(x)
-        if x in path:
-            return path + [x]
+        if detector.update(x):
+            cycle = cycles.locate(reduce_func, path[0], detector.length)
+            return path[:cycle.tail + cycle.length] + [cycle.entry]
     return path + [x]
 
-def print_status(current, _max, step=0.1):
-    int_step = int(_max * step)
-    if current % int_step == 0:
-        percentage = float(current) / float(_max)
-        print('[{}]'.format(percentage))
-    return
-
-def main(args):
-
-    _max = args.max
-
-    retval = {}
-    longest_path = (None, [])
-
-    # please ignore the ugliness
-    if args.mode == 'sequential':
-        target = 2
-        
+# how many targets a worker takes at a time
+SHARD_SIZE = 10000
 
-        while target < _max:
+# fraction of the targets between progress lines
+STATUS_STEP = 0.1
 
-            x = target
-            path = reduce(x)
-
-            try:
-                assert path[-1] == 2
-            except:
-                print("FAIL")
-                print(target)
-                pprint.pprint(path)
+# Streaming aggregates over reduced paths: how many, the longest, a histogram of
+# their lengths, the first failure, and a uniform sample of at most sample_size
+# paths. Nothing else is kept, so memory stays flat however many targets are run.
+#
+# The sample keeps the paths with the smallest random keys, which is uniform over
+# everything added and still is after merging summaries.
+class PathSummary:
+
+    def __init__(self, sample_size=0):
+        self.sample_size = sample_size
+        self.count = 0
+        self.longest = (None, [])
+        self.lengths = Counter()
+        self.failure = None
+        self._sample = []
+
+    # A path of length elements ending on last. path() gives the path itself and is
+    # only asked for when the path is kept. key is the path's draw for the sample.
+    def add(self, target, length, last, path, key=0.0):
+        self.count += 1
+        self.lengths[length] += 1
+        if length > len(self.longest[1]):
+            self.longest = (target, path())
+        if last != 2 and self.failure is None:
+            self.failure = (target, path())
+        if self._wants(key):
+            self._keep(key, target, path())
+
+    def _wants(self, key):
+        if len(self._sample) < self.sample_size:
+            return True
+        return self.sample_size > 0 and -key > self._sample[0][0]
+
+    def _keep(self, key, target, path):
+        if len(self._sample) < self.sample_size:
+            heapq.heappush(self._sample, (-key, target, path))
+        elif self._wants(key):
+            heapq.heapreplace(self._sample, (-key, target, path))
+
+    # merge in a summary of later targets
+    def merge(self, other):
+        self.count += other.count
+        self.lengths.update(other.lengths)
+        if len(other.longest[1]) > len(self.longest[1]):
+            self.longest = other.longest
+        if self.failure is None:
+            self.failure = other.failure
+        for key, target, path in other._sample:
+            self._keep(-key, target, path)
+
+    def sample(self):
+        return sorted((target, path) for key, target, path in self._sample)
+
+# what the workers reduce with, set by init_worker. graph is None when the
+# successor graph is off (a bound of 0).
+sample_size = 0
+graph = None
+
+def init_worker(bound, path, size, graph_bound=GRAPH_BOUND):
+    global factorizer, sample_size, graph
+    # a forked worker already has the parent's sieve
+    if factorizer is None:
+        factorizer = Factorizer(bound, path).build()
+    sample_size = size
+    # every worker keeps its own graph, which fills in over its shards
+    graph = SuccessorGraph(reduce_func_sqarem_and_smallest_factor, graph_bound) if graph_bound else None
+
+# reduce target into summary, through the successor graph if there is one
+def summarize(summary, target, key):
+    if graph is None:
+        path = reduce(target)
+        summary.add(target, len(path), path[-1], lambda: path, key)
+    else:
+        depth, terminal = graph.resolve(target)
+        summary.add(target, depth + 1, terminal, lambda: graph.path(target), key)
+
+# Reduce one shard of targets. A sequential shard is the targets in [lo, hi), a
+# random one draws hi - lo targets from [2, _max] with its own seed. A shard stops
+# at its first failure.
+def reduce_shard(shard):
+    mode, lo, hi, _max, seed = shard
+    rng = random.Random(f'{seed}-{lo}')
+    summary = PathSummary(sample_size)
+    for i in range(lo, hi):
+        target = i if mode == 'sequential' else rng.randint(2, _max)
+        summarize(summary, target, rng.random())
+        if summary.failure is not None:
+            break
+    return summary
+
+# print the fraction done whenever a merge carries it past a multiple of step
+def print_status(before, current, total, step=STATUS_STEP):
+    nsteps = round(1 / step)
+    if total and current * nsteps // total > before * nsteps // total:
+        print('[{}]'.format(float(current) / float(total)))
+
+def shards(mode, _max, niters, seed, shard_size=SHARD_SIZE):
+    if mode == 'sequential':
+        lo, total = 2, _max
+    else:
+        lo, total = 0, niters
+    for start in range(lo, total, shard_size):
+        yield (mode, start, min(start + shard_size, total), _max, seed)
+
+# Shard the targets across a pool of workers and merge their summaries in target
+# order (draw order in random mode), so the first failure is the one the serial
+# loop would have stopped at. Work past it is cancelled.
+def run(mode, _max, niters, nworkers=None, sample_size=0, seed=None, shard_size=SHARD_SIZE, bound=SIEVE_BOUND, path=None, graph_bound=GRAPH_BOUND):
+
+    if nworkers is None:
+        nworkers = cpu_count()
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    global factorizer
+    if factorizer is None or factorizer.bound != bound or factorizer.path != path:
+        factorizer = Factorizer(bound, path).build()
+
+    # no shard bigger than a status step, so every step gets its line
+    total = _max - 2 if mode == 'sequential' else niters
+    shard_size = max(1, min(shard_size, -(-total // round(1 / STATUS_STEP))))
+    summary = PathSummary(sample_size)
+
+    pool = Pool(processes=nworkers, initializer=init_worker, initargs=(bound, path, sample_size, graph_bound))
+    try:
+        for part in pool.imap(reduce_shard, shards(mode, _max, niters, seed, shard_size)):
+            before = summary.count
+            summary.merge(part)
+            print_status(before, summary.count, total)
+            if summary.failure is not None:
+                pool.terminate()
                 break
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
-            if len(path) > len(longest_path[1]):
-                longest_path = (target, path)
-
-            retval[target] = path
-            target += 1
-
-            print_status(target, _max)
-
-    elif args.mode == 'random':
-        niters = 0
+    return summary
 
-        while niters < args.niters:
-
-            target = random.randint(2, args.max)
-            path = reduce(target)
-
-            try:
-                assert path[-1] == 2
-            except:
-                print("FAIL")
-                print(target)
-                pprint.pprint(path)
-                break
+def main(args):
 
-            if len(path) > len(longest_path[1]):
-                longest_path = target, path
+    summary = run(args.mode, args.max, args.niters, args.workers, args.sample, args.seed, args.shard_size, args.sieve_bound, args.sieve_path, args.graph_bound)
 
-            retval[target] = path
-            niters += 1
+    if summary.failure is not None:
+        target, path = summary.failure
+        print("FAIL")
+        print(target)
+        pprint.pprint(path)
 
-            print_status(niters, args.niters)
+    print(f'{summary.count} paths, lengths:')
+    for length, count in sorted(summary.lengths.items()):
+        print(f'{length:>6} {count}')
 
-    pprint.pprint(longest_path)
+    pprint.pprint(summary.longest)
     import pdb;pdb.set_trace()
 
     return
@@ -165,6 +279,19 @@ if __name__ == "__main__":
         help='sum the integers (default: find the max)')
     parser.add_argument('--niters', type=int, default=10000,
         help='The number of iterations to do in random mode. Only applicable in random mode.')
+    parser.add_argument('--sieve-bound', type=int, default=SIEVE_BOUND,
+        help='Values up to this are factored from a smallest-prime-factor sieve.')
+    parser.add_argument('--sieve-path', default=None,
+        help='Keep the sieve in this .npy file and memory-map it, instead of building it every run.')
+    parser.add_argument('--graph-bound', type=int, default=GRAPH_BOUND,
+        help='Values up to this get a dense slot in the successor graph, 0 turns the graph off.')
+    parser.add_argument('--workers', type=int, default=cpu_count())
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE,
+        help='How many targets a worker takes at a time.')
+    parser.add_argument('--sample', type=int, default=0,
+        help='Keep a uniform sample of this many paths (summary.sample() at the prompt).')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Seed for the random targets and the sample, so a run can be repeated.')
 
     args = parser.parse_args()
 
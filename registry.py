@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import numpy as np
+from numba import njit, uint64
+
+import cycles
+from strip import strip_bigint
+
+
+# where the cycles found so far are kept between runs
+REGISTRY_PATH = 'cycles.registry.json'
+
+U64_MAX = 2**64 - 1
+
+
+# One step of the strong map exactly as the kernels take it: strip the primes below
+# coeff if any divide, otherwise coeff*n + 1. Cycle members are values of this map,
+# so both the stripped and the multiplied values of a cycle are in it.
+def kernel_step(coeff, n):
+    stripped, early_return = strip_bigint(n, coeff)
+    if early_return:
+        return stripped
+    return coeff * n + 1
+
+
+# Every non-trivial cycle found so far, per coefficient, kept as json so it can be
+# read by hand. A cycle is recorded by its minimal element (and its length), the
+# members are walked out again when the kernels ask for them.
+#
+# members(coeff) is a sorted uint64 array of every member of every known cycle,
+# with owners[i] the minimal element of the cycle members[i] belongs to. A kernel
+# binary searches it each step and stops a lane as soon as it lands on a cycle.
+class CycleRegistry:
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.cycles = {}
+        self._members = {}
+
+    # returns False when there is nothing to load
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        self.cycles = {int(coeff): {int(m): length for m, length in known} for coeff, known in state.items()}
+        self._members = {}
+        return True
+
+    # write to a temporary file and swap it in, like Checkpoint.save
+    def save(self):
+        state = {str(coeff): sorted(known.items()) for coeff, known in self.cycles.items()}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # the minimal elements of the known cycles of C_coeff
+    def known(self, coeff):
+        return sorted(self.cycles.get(coeff, {}))
+
+    def walk(self, coeff, x):
+        members = [x]
+        y = kernel_step(coeff, x)
+        while y != x:
+            members.append(y)
+            y = kernel_step(coeff, y)
+        return members
+
+    # Register the cycle through x, which must be on it. Returns the minimal element
+    # and whether the cycle is new.
+    def add(self, coeff, x):
+        members = self.walk(coeff, x)
+        minimum = min(members)
+        known = self.cycles.setdefault(coeff, {})
+        if minimum in known:
+            return minimum, False
+        known[minimum] = len(members)
+        self._members.pop(coeff, None)
+        return minimum, True
+
+    # Follow n until it reaches 1 or a cycle, registering the cycle. Returns what
+    # add does, or (None, False) if n reached 1.
+    def discover(self, coeff, n):
+        step = lambda x: kernel_step(coeff, x)
+        cycle = cycles.find_cycle(step, n, lambda x: x == 1)
+        if cycle is None:
+            return None, False
+        return self.add(coeff, cycle.entry)
+
+    # the sorted member array and its owners, see above. Members past 64 bits can
+    # never turn up in a kernel and are left out.
+    def members(self, coeff):
+        if coeff not in self._members:
+            pairs = sorted((x, minimum) for minimum in self.known(coeff) for x in self.walk(coeff, minimum) if x <= U64_MAX)
+            self._members[coeff] = (
+                np.array([x for x, _ in pairs], dtype=np.uint64),
+                np.array([minimum for _, minimum in pairs], dtype=np.uint64),
+            )
+        return self._members[coeff]
+
+    # members for several coefficients packed into flat arrays, coefficient c's
+    # are [offsets[c], offsets[c + 1]), the same layout as strip.strip_tables
+    def packed(self, coeffs):
+        arrays = [self.members(coeff) for coeff in coeffs]
+        return (
+            np.concatenate([members for members, _ in arrays]),
+            np.concatenate([owners for _, owners in arrays]),
+            np.cumsum([0] + [members.size for members, _ in arrays]),
+        )
+
+    # the minimal element of the known cycle x is on, or None
+    def cycle_of(self, coeff, x):
+        members, owners = self.members(coeff)
+        i = np.searchsorted(members, np.uint64(x))
+        if i < members.size and members[i] == x:
+            return int(owners[i])
+        return None
+
+
+# The kernel side of cycle_of: the minimal element of the cycle x is on, 0 if none
+@njit(nogil=True, inline='always')
+def known_cycle(x, members, owners):
+    if members.size == 0:
+        return uint64(0)
+    i = np.searchsorted(members, uint64(x))
+    if i < members.size and members[i] == x:
+        return owners[i]
+    return uint64(0)
+
+
+# The same for a whole array of lanes at once
+def known_cycles(x, members, owners):
+    if members.size == 0:
+        return np.zeros(x.shape, dtype=np.uint64)
+    i = np.minimum(np.searchsorted(members, x), members.size - 1)
+    return np.where(members[i] == x, owners[i], np.uint64(0))
+
+
+# list the cycles known for each coefficient given on the command line (or all)
+if __name__ == "__main__":
+
+    registry = CycleRegistry(sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].isdigit() else REGISTRY_PATH)
+    registry.load()
+
+    coeffs = [int(a) for a in sys.argv[1:] if a.isdigit()] or sorted(registry.cycles)
+    for coeff in coeffs:
+        for minimum in registry.known(coeff):
+            print(f'[C_{coeff}] cycle of length {registry.cycles[coeff][minimum]} with minimal element {minimum}')
@@ -0,0 +1,84 @@
+import json
+from collections import namedtuple, Counter
+
+
+# Per-trajectory measurements. The reductions keep these as plain local counters in
+# their loops and hand over one record at the end, so collecting costs nothing per
+# step beyond the counters themselves.
+#
+# start_bits: bit length of the starting integer
+# stopping_time: steps to reach 1 (a strip or a coeff*n + 1 each)
+# peak_bits: the largest bit length on the way
+# strip_steps: steps that removed small primes, however many they removed
+# multiplies: coeff*n + 1 steps
+Trajectory = namedtuple('Trajectory', ['start_bits', 'stopping_time', 'peak_bits', 'strip_steps', 'multiplies'])
+
+# histogram bin widths, per field
+BINS = {
+    'start_bits': 8,
+    'stopping_time': 16,
+    'peak_bits': 8,
+    'strip_steps': 16,
+    'multiplies': 16,
+}
+
+
+# Aggregates Trajectory records per coefficient: a count, per-field totals,
+# minimum and maximum, and a histogram of each field binned by BINS.
+class Stats:
+
+    def __init__(self, bins=BINS):
+        self.bins = bins
+        self.coefficients = {}
+
+    def _entry(self, coeff):
+        entry = self.coefficients.get(coeff)
+        if entry is None:
+            entry = {
+                'count': 0,
+                'total': Counter(),
+                'min': {},
+                'max': {},
+                'histograms': {field: Counter() for field in Trajectory._fields},
+            }
+            self.coefficients[coeff] = entry
+        return entry
+
+    def record(self, coeff, trajectory):
+        entry = self._entry(coeff)
+        entry['count'] += 1
+        for field, value in zip(Trajectory._fields, trajectory):
+            entry['total'][field] += value
+            entry['min'][field] = min(entry['min'].get(field, value), value)
+            entry['max'][field] = max(entry['max'].get(field, value), value)
+            width = self.bins[field]
+            entry['histograms'][field][value // width * width] += 1
+
+    def mean(self, coeff, field):
+        entry = self.coefficients[coeff]
+        return entry['total'][field] / entry['count']
+
+    # histogram bins are keyed by their lower edge
+    def to_json(self):
+        return {
+            'bins': self.bins,
+            'coefficients': {
+                str(coeff): {
+                    'count': entry['count'],
+                    'total': dict(entry['total']),
+                    'min': entry['min'],
+                    'max': entry['max'],
+                    'histograms': {field: {str(k): v for k, v in sorted(h.items())} for field, h in entry['histograms'].items()},
+                }
+                for coeff, entry in sorted(self.coefficients.items())
+            },
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def summary(self):
+        for coeff, entry in sorted(self.coefficients.items()):
+            means = ', '.join(f'{field} {self.mean(coeff, field):.1f}' for field in Trajectory._fields)
+            print(f'[C_{coeff}] {entry["count"]} trajectories, mean {means}, max peak bits {entry["max"]["peak_bits"]}')
@@ -0,0 +1,365 @@
+from collections import namedtuple
+import functools
+import math
+import numpy as np
+import sympy
+from numba import njit, uint64
+
+from wide import fold192, mul192_lo, shr192_1
+
+# gmpy2 is optional, the big integer paths fall back to Python ints without it
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+# the residue table covers as many small odd primes as fit under this modulus
+RESIDUE_MODULUS_MAX = 2**16
+
+U64_MAX = 2**64 - 1
+
+
+# Everything needed to strip the primes below a coefficient from a uint64.
+#
+# For an odd prime p, n is divisible by p exactly when n * inverse(p) mod 2^64 is
+# at most (2^64 - 1) // p, and in that case the product is n // p. So every test
+# and every division is a single multiply.
+#
+# residues[n % modulus] has bit i set when primes[i] divides n, for the first
+# nresidue odd primes. Those primes are only tried when the table says they
+# divide, the rest are tested with the multiply.
+#
+# This is a namedtuple so numba can take it straight into a kernel.
+StripTable = namedtuple('StripTable', ['primes', 'inverses', 'limits', 'residues', 'modulus', 'nresidue', 'strip_two'])
+
+
+@functools.lru_cache
+def strip_table(coeff):
+    primes = list(sympy.sieve.primerange(coeff))
+    strip_two = len(primes) > 0 and primes[0] == 2
+    odd_primes = [p for p in primes if p != 2]
+
+    modulus = 1
+    nresidue = 0
+    for p in odd_primes:
+        if modulus * p > RESIDUE_MODULUS_MAX:
+            break
+        modulus *= p
+        nresidue += 1
+
+    residues = np.zeros(modulus, dtype=np.uint64)
+    for i, p in enumerate(odd_primes[:nresidue]):
+        residues[::p] |= np.uint64(1 << i)
+
+    return StripTable(
+        np.array(odd_primes, dtype=np.uint64),
+        np.array([pow(p, -1, 2**64) for p in odd_primes], dtype=np.uint64),
+        np.array([U64_MAX // p for p in odd_primes], dtype=np.uint64),
+        residues,
+        uint64(modulus),
+        nresidue,
+        strip_two,
+    )
+
+
+# The tables for several coefficients packed into flat arrays, so a kernel can take
+# all of them at once. Coefficient c's rows are [offsets[c], offsets[c + 1]).
+StripTables = namedtuple('StripTables', ['primes', 'inverses', 'limits', 'prime_offsets', 'residues', 'residue_offsets', 'moduli', 'nresidue', 'strip_two'])
+
+
+def strip_tables(coeffs):
+    tables = [strip_table(coeff) for coeff in coeffs]
+    return StripTables(
+        np.concatenate([t.primes for t in tables]),
+        np.concatenate([t.inverses for t in tables]),
+        np.concatenate([t.limits for t in tables]),
+        np.cumsum([0] + [t.primes.size for t in tables]),
+        np.concatenate([t.residues for t in tables]),
+        np.cumsum([0] + [t.residues.size for t in tables]),
+        np.array([t.modulus for t in tables], dtype=np.uint64),
+        np.array([t.nresidue for t in tables], dtype=np.int64),
+        np.array([t.strip_two for t in tables], dtype=np.bool_),
+    )
+
+
+# coefficient c's StripTable, as views into the packed arrays
+@njit(nogil=True, inline='always')
+def table_at(tables, c):
+    p0 = tables.prime_offsets[c]
+    p1 = tables.prime_offsets[c + 1]
+    r0 = tables.residue_offsets[c]
+    r1 = tables.residue_offsets[c + 1]
+    return StripTable(
+        tables.primes[p0:p1],
+        tables.inverses[p0:p1],
+        tables.limits[p0:p1],
+        tables.residues[r0:r1],
+        tables.moduli[c],
+        tables.nresidue[c],
+        tables.strip_two[c],
+    )
+
+
+# Remove every prime in the table from n. Returns the stripped value and
+# whether anything was removed.
+@njit(nogil=True)
+def strip_u64(n, table):
+
+    n = uint64(n)
+    if n == 0:
+        return n, False
+
+    stripped = False
+
+    if table.strip_two:
+        while n & uint64(1) == 0:
+            n = n >> uint64(1)
+            stripped = True
+
+    mask = table.residues[n % table.modulus]
+    for i in range(table.nresidue):
+        if (mask >> uint64(i)) & uint64(1):
+            q = n * table.inverses[i]
+            while q <= table.limits[i]:
+                n = q
+                q = n * table.inverses[i]
+            stripped = True
+
+    for i in range(table.nresidue, table.inverses.size):
+        q = n * table.inverses[i]
+        while q <= table.limits[i]:
+            n = q
+            stripped = True
+            q = n * table.inverses[i]
+
+    return n, stripped
+
+
+# The same for 192-bit values. The first fields are the StripTable's, so it works
+# with strip_u64 as is once a value fits one limb (it isn't nested, parallel
+# kernels can't take nested tuples).
+#
+# For wider values, weights[i] folds the limbs into a 64-bit value congruent mod
+# primes[i] (see wide.fold192), which the usual inverse test checks for
+# divisibility, and mweights does the same for the residue modulus. A prime that
+# divides is taken out by multiplying with its inverse mod 2^192, limbs in
+# inv2/inv1/inv0. So a 192-bit strip never divides either.
+WideStripTable = namedtuple('WideStripTable', StripTable._fields + ('weights', 'mweights', 'inv2', 'inv1', 'inv0'))
+
+# fold192 needs every prime and the residue modulus below 2^16
+WIDE_PRIME_MAX = 2**16
+
+
+@functools.lru_cache
+def wide_strip_table(coeff):
+    base = strip_table(coeff)
+    primes = [int(p) for p in base.primes]
+    modulus = int(base.modulus)
+    if coeff > WIDE_PRIME_MAX:
+        raise Exception(f'C_{coeff} is too large for the 192-bit strip table')
+
+    inverses = [pow(p, -1, 2**192) for p in primes]
+    return WideStripTable(
+        *base,
+        np.array([[pow(2, 32 * k, p) for k in range(6)] for p in primes], dtype=np.uint64).reshape(len(primes), 6),
+        np.array([pow(2, 32 * k, modulus) for k in range(6)], dtype=np.uint64),
+        np.array([inv >> 128 for inv in inverses], dtype=np.uint64),
+        np.array([(inv >> 64) & U64_MAX for inv in inverses], dtype=np.uint64),
+        np.array([inv & U64_MAX for inv in inverses], dtype=np.uint64),
+    )
+
+
+# Remove every prime in the table from (a2, a1, a0). Returns the stripped limbs and
+# whether anything was removed.
+@njit(nogil=True)
+def strip_u192(a2, a1, a0, table):
+
+    if a2 == 0 and a1 == 0:
+        n, stripped = strip_u64(a0, table)
+        return uint64(0), uint64(0), n, stripped
+
+    stripped = False
+
+    if table.strip_two:
+        while a0 == 0:
+            a2, a1, a0 = uint64(0), a2, a1
+            stripped = True
+        while a0 & uint64(1) == 0:
+            a2, a1, a0 = shr192_1(a2, a1, a0)
+            stripped = True
+
+    mask = table.residues[fold192(a2, a1, a0, table.mweights) % table.modulus]
+    for i in range(table.primes.size):
+        if i < table.nresidue and not (mask >> uint64(i)) & uint64(1):
+            continue
+        while fold192(a2, a1, a0, table.weights[i]) * table.inverses[i] <= table.limits[i]:
+            a2, a1, a0 = mul192_lo(a2, a1, a0, table.inv2[i], table.inv1[i], table.inv0[i])
+            stripped = True
+            if a2 == 0 and a1 == 0:
+                # the rest fits one limb
+                n, _ = strip_u64(a0, table)
+                return uint64(0), uint64(0), n, True
+
+    return a2, a1, a0, stripped
+
+
+# The same thing for a whole array of lanes at once. Returns new arrays.
+def strip_lanes(n, table):
+
+    n = np.array(n, dtype=np.uint64)
+    stripped = np.zeros(n.shape, dtype=bool)
+
+    # zero is divisible by everything, leave it alone
+    nonzero = n != 0
+
+    if table.strip_two:
+        lowbit = n & (~n + np.uint64(1))
+        twos = nonzero & (lowbit != 1)
+        n[twos] //= lowbit[twos]
+        stripped |= twos
+
+    mask = table.residues[n % table.modulus]
+    for i in range(table.nresidue):
+        lanes = np.flatnonzero(nonzero & ((mask >> np.uint64(i)) & np.uint64(1) == 1))
+        stripped[lanes] = True
+        while lanes.size > 0:
+            n[lanes] *= table.inverses[i]
+            lanes = lanes[n[lanes] * table.inverses[i] <= table.limits[i]]
+
+    for i in range(table.nresidue, table.inverses.size):
+        lanes = np.flatnonzero(nonzero & (n * table.inverses[i] <= table.limits[i]))
+        stripped[lanes] = True
+        while lanes.size > 0:
+            n[lanes] *= table.inverses[i]
+            lanes = lanes[n[lanes] * table.inverses[i] <= table.limits[i]]
+
+    return n, stripped
+
+
+# Big integers: one n % primorial and a gcd against the (small) primorial says which
+# primes divide n at all, so primes that don't divide cost nothing. Twos are shifted
+# out, and any other prime that divides is removed with its p^(2^j) powers, so an
+# exponent e costs O(log e) divisions.
+
+@functools.lru_cache
+def primorial(coeff):
+    primes = list(sympy.sieve.primerange(coeff))
+    product = 1
+    for p in primes:
+        product *= p
+    return primes, product
+
+
+# p^(2^j) for j = 0, 1, ..., grown on demand
+_prime_powers = {}
+
+def prime_powers(p, j):
+    powers = _prime_powers.setdefault(p, [p])
+    while len(powers) <= j:
+        powers.append(powers[-1] * powers[-1])
+    return powers
+
+
+def strip_prime_power(n, p):
+    # most of the time p only goes in once
+    n //= p
+    if n % p != 0:
+        return n
+
+    powers = prime_powers(p, 0)
+
+    # divide by p, p^2, p^4, ... while they go in
+    j = 0
+    while n % powers[j] == 0:
+        n //= powers[j]
+        j += 1
+        powers = prime_powers(p, j)
+
+    # whatever is left of the exponent is smaller than the last power that went in
+    for k in range(j - 1, -1, -1):
+        if n % powers[k] == 0:
+            n //= powers[k]
+
+    return n
+
+
+def strip_bigint(n, coeff):
+    primes, product = primorial(coeff)
+
+    g = math.gcd(n % product, product)
+    if g == 1:
+        return n, False
+
+    # twos come off with a single shift
+    if g & 1 == 0:
+        n >>= (n & -n).bit_length() - 1
+        g >>= 1
+
+    for p in primes:
+        if g == 1:
+            break
+        if g % p == 0:
+            n = strip_prime_power(n, p)
+            g //= p
+
+    return n, True
+
+
+# The same with gmpy2. One gcd straight against the primorial says which primes
+# divide n, and remove() takes every power of such a prime out in a single call.
+# n stays an mpz throughout.
+@functools.lru_cache
+def mpz_stripper(coeff):
+    primes, product = primorial(coeff)
+    strip_two = 2 in primes
+    odd_primes = [gmpy2.mpz(p) for p in primes if p != 2]
+    product = gmpy2.mpz(product)
+    gcd, remove, bit_scan1 = gmpy2.gcd, gmpy2.remove, gmpy2.bit_scan1
+
+    def strip(n):
+        g = gcd(n, product)
+        if g == 1:
+            return n, False
+
+        if strip_two and not g & 1:
+            n >>= bit_scan1(n)
+            g >>= 1
+
+        for p in odd_primes:
+            if g == 1:
+                break
+            if not g % p:
+                n = remove(n, p)[0]
+                g //= p
+
+        return n, True
+
+    return strip
+
+
+def python_stripper(coeff):
+    return functools.partial(strip_bigint, coeff=coeff)
+
+
+# The arbitrary precision engines the big integer paths run on. convert turns a
+# start value into the engine's integer type, and stripper(coeff) gives a strip(n)
+# for that coefficient that returns what strip_bigint does. The step itself is
+# coeff * n + 1 on whatever convert returned.
+BigIntEngine = namedtuple('BigIntEngine', ['name', 'convert', 'stripper'])
+
+BIGINT_ENGINES = {
+    'python': BigIntEngine('python', int, python_stripper),
+    'gmpy2': BigIntEngine('gmpy2', gmpy2.mpz if gmpy2 else None, mpz_stripper),
+}
+
+DEFAULT_BIGINT_ENGINE = 'gmpy2' if gmpy2 is not None else 'python'
+
+
+def bigint_engine(name=DEFAULT_BIGINT_ENGINE):
+    if name not in BIGINT_ENGINES:
+        raise Exception(f'Unknown big integer engine {name}')
+    if name == 'gmpy2' and gmpy2 is None:
+        print('gmpy2 is not installed, falling back to Python ints')
+        name = 'python'
+    return BIGINT_ENGINES[name]
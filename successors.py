@@ -0,0 +1,121 @@
+import numpy as np
+
+import cycles
+
+
+# values up to this get a slot in the dense arrays, 16 bytes each
+GRAPH_BOUND = 2**22
+
+# values past the bound kept in the overflow dict; past this many they aren't stored
+OVERFLOW_LIMIT = 2**20
+
+# where every trajectory stops unless it loops
+TERMINAL = 2
+
+# depth of a slot that hasn't been resolved
+UNRESOLVED = -1
+
+
+# The successor graph of a reduce func, filled in as trajectories are walked, so a
+# trajectory stops as soon as it joins one walked before.
+#
+# Every resolved node keeps its successor, its depth and its terminal, with the
+# depth and terminal being what primality.reduce would end on: len(path) - 1 and
+# path[-1]. A node that reaches 2 has its step count as depth and 2 as terminal. A
+# node that loops has its tail plus the cycle length as depth, and as terminal the
+# first cycle member it reaches. A new trajectory that lands on a resolved node k
+# steps in inherits its terminal and depth + k, and every node on the way is
+# resolved too.
+#
+# Values up to bound are kept in arrays (next, depth, and an index into terminals),
+# the rest in a dict up to overflow_limit entries. Nodes that fit neither are walked
+# again when they come up. Cycle members always go in, past the limit if need be:
+# a walk has to stop on the member where it enters the cycle, which is its terminal,
+# not carry on round to one that happens to be stored.
+class SuccessorGraph:
+
+    def __init__(self, reduce_func, bound=GRAPH_BOUND, overflow_limit=OVERFLOW_LIMIT, method=cycles.DEFAULT_DETECTOR):
+        self.reduce_func = reduce_func
+        self.bound = bound
+        self.overflow_limit = overflow_limit
+        self.method = method
+        self.next = np.zeros(bound + 1, dtype=np.uint64)
+        self.depth = np.full(bound + 1, UNRESOLVED, dtype=np.int32)
+        self.terminal = np.zeros(bound + 1, dtype=np.int32)
+        self.overflow = {}
+        self.terminals = [TERMINAL]
+        self._terminal_index = {TERMINAL: 0}
+        self._set(TERMINAL, reduce_func(TERMINAL), 0, TERMINAL)
+
+    # (next, depth, terminal) of a resolved node, None otherwise
+    def _get(self, x):
+        if x <= self.bound:
+            depth = int(self.depth[x])
+            if depth != UNRESOLVED:
+                return int(self.next[x]), depth, self.terminals[self.terminal[x]]
+        return self.overflow.get(x)
+
+    def _set(self, x, nxt, depth, terminal, member=False):
+        if x <= self.bound and nxt < 2**64:
+            index = self._terminal_index.get(terminal)
+            if index is None:
+                index = len(self.terminals)
+                self.terminals.append(terminal)
+                self._terminal_index[terminal] = index
+            self.next[x] = nxt
+            self.depth[x] = depth
+            self.terminal[x] = index
+        elif member or len(self.overflow) < self.overflow_limit:
+            self.overflow[x] = (nxt, depth, terminal)
+
+    # (depth, terminal) of x, walking only as far as the first resolved node
+    def resolve(self, x):
+        known = self._get(x)
+        if known is not None:
+            return known[1], known[2]
+
+        path = []
+        detector = cycles.detector(self.reduce_func, x, self.method)
+        y = x
+        while True:
+            known = self._get(y)
+            if known is not None:
+                depth, terminal = known[1], known[2]
+                for i in range(len(path) - 1, -1, -1):
+                    depth += 1
+                    self._set(path[i], path[i + 1] if i + 1 < len(path) else y, depth, terminal)
+                return depth, terminal
+
+            path.append(y)
+            y = self.reduce_func(y)
+            if detector.update(y):
+                break
+
+        # the walk looped without meeting anything resolved, so the whole cycle is
+        # on it (see primality.reduce)
+        path.append(y)
+        cycle = cycles.locate(self.reduce_func, path[0], detector.length)
+        end = cycle.tail + cycle.length
+        while len(path) <= end:
+            path.append(self.reduce_func(path[-1]))
+
+        for i in range(cycle.tail, end):
+            self._set(path[i], path[i + 1], cycle.length, path[i], member=True)
+        for i in range(cycle.tail):
+            self._set(path[i], path[i + 1], end - i, cycle.entry)
+        return end, cycle.entry
+
+    def successor(self, x):
+        known = self._get(x)
+        if known is not None:
+            return known[0]
+        return self.reduce_func(x)
+
+    # the path primality.reduce would return for x, walked from the stored successors
+    def path(self, x):
+        depth, terminal = self.resolve(x)
+        retval = [x]
+        for _ in range(depth):
+            x = self.successor(x)
+            retval.append(x)
+        return retval
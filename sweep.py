@@ -0,0 +1,167 @@
+import sys
+import math
+import time
+import random
+import numpy as np
+from numba import njit, prange, uint64
+
+from cuda import (collatz_lane_cpu, generate_chunks, record_cycles, CHUNK_SIZE, DIVERGENCE_CAP,
+    MIN_COEFFICIENT, MAX_COEFFICIENT, RANDOM_NUM_TESTS, SERIAL_NUM_TESTS,
+    RANDOM_ELEMENT_MIN, RANDOM_ELEMENT_MAX, STATUS_DTYPE, UNINITIALIZED_STATUS,
+    CONVERGED, DIVERGED, LOOP_DETECTED, ABANDONED, OVERFLOW, ERROR, DEFERRED, STATUS_STOP)
+from strip import strip_tables, table_at
+from registry import CycleRegistry, REGISTRY_PATH
+from witness import Witnesses
+
+
+# Test many coefficients against one shared stream of integers.
+#
+# Every chunk is reduced for all the coefficients still standing in a single
+# parallel kernel, so the cores are shared between them. A coefficient is dropped
+# the moment one of its lanes loops, diverges or overflows: its status flag
+# abandons the rest of its lanes in that chunk, and it is left out of every chunk
+# after, so a sweep costs about as much as testing the survivors alone.
+
+
+# results[c, idx] for coeffs[c] on n_arr[idx], and hits[c, idx] the known cycle
+# it fell into, values, steps and peaks where it stopped (see collatz_lane_cpu).
+# Lanes are interleaved across the coefficients so each thread gets a share of
+# every one of them. members, owners and offsets are the registry's known cycles,
+# packed by CycleRegistry.packed.
+@njit(parallel=True, nogil=True)
+def collatz_sweep_cpu(n_arr, coeffs, divergence_limit, results, status_flags, tables, stop_below, verified_below, members, owners, offsets, hits, values, steps, peaks):
+
+    ncoeffs = coeffs.size
+    for i in prange(n_arr.size * ncoeffs):
+        c = i % ncoeffs
+        idx = i // ncoeffs
+
+        status_flag = status_flags[c:c + 1]
+        if status_flag[0] != 0:
+            results[c, idx] = ABANDONED
+            continue
+
+        k0 = offsets[c]
+        k1 = offsets[c + 1]
+        result, cycle, value, lane_steps, peak = collatz_lane_cpu(n_arr[idx], coeffs[c], divergence_limit, status_flag, table_at(tables, c), stop_below, verified_below, members[k0:k1], owners[k0:k1])
+        if result == DIVERGED or result == OVERFLOW:
+            status_flag[0] = STATUS_STOP
+        results[c, idx] = result
+        hits[c, idx] = cycle
+        values[c, idx] = value
+        steps[c, idx] = lane_steps
+        peaks[c, idx] = peak
+
+
+# witnesses gets a record of every lane that didn't converge, keyed sweep-method-coeff
+def sweep(coeffs, test_size, divergence_limit, ele_min, ele_max, method=None, chunk_size=CHUNK_SIZE, registry=None, witnesses=None):
+
+    if method not in ('random', 'serial'):
+        raise Exception('Unknown method')
+    if method == 'serial' and ele_max != None:
+        raise Exception('Serial tests do not incorporate ele_max, they use ele_min + test_size')
+
+    t1 = time.time()
+    total = test_size + 1
+    if method == 'random':
+        print(f'------ Random sweep [{len(coeffs)} coefficients] ------')
+        print(f'Sampling random integers in the interval ({ele_min}[2^{int(math.log(ele_min,2))}], {ele_max}[2^{int(math.log(ele_max,2))}])')
+    else:
+        print(f'------ Serial sweep [{len(coeffs)} coefficients] ------')
+        print(f'Testing {total} integers in serial beginning at {ele_min}')
+
+    if registry is None:
+        registry = CycleRegistry()
+        registry.load()
+
+    # running count of every status code seen so far, and of the lanes that fell
+    # into each known cycle, per coefficient
+    counts = {coeff: np.zeros(256, dtype=np.int64) for coeff in coeffs}
+    cycle_hits = {coeff: {} for coeff in coeffs}
+    active = list(coeffs)
+    stop_below = method == 'serial' and ele_min == 1
+
+    processed = 0
+    for lo, n_arr in generate_chunks(method, total, ele_min, ele_max, chunk_size, random.getrandbits(64)):
+
+        tables = strip_tables(active)
+        status_flags = np.zeros(len(active), dtype=np.int64)
+        result_arr = np.full((len(active), n_arr.size), UNINITIALIZED_STATUS, dtype=STATUS_DTYPE)
+        hits = np.zeros((len(active), n_arr.size), dtype=np.uint64)
+        values = np.zeros((len(active), n_arr.size), dtype=np.uint64)
+        steps = np.zeros((len(active), n_arr.size), dtype=np.uint64)
+        peaks = np.zeros((len(active), n_arr.size), dtype=np.uint64)
+        members, owners, offsets = registry.packed(active)
+
+        # a coefficient still standing converged on every chunk before this one
+        verified_below = ele_min + lo if stop_below else 0
+        collatz_sweep_cpu(n_arr, np.array(active, dtype=np.uint64), uint64(divergence_limit), result_arr, status_flags, tables, stop_below, uint64(verified_below), members, owners, offsets, hits, values, steps, peaks)
+
+        processed = lo + n_arr.size
+        for c, coeff in enumerate(active):
+            counts[coeff] += np.bincount(result_arr[c], minlength=256)
+            record_cycles(coeff, n_arr, result_arr[c], hits[c], registry, cycle_hits[coeff])
+            if witnesses is not None:
+                witnesses.add(f'sweep-{method}-{coeff}', lo, n_arr, result_arr[c], hits[c], values[c], steps[c], peaks[c])
+            if status_flags[c] != 0:
+                print(f'[C_{coeff}] eliminated after {processed} integers')
+                # the rest of the stream is abandoned for this one
+                counts[coeff][ABANDONED] += total - processed
+
+        active = [coeff for c, coeff in enumerate(active) if status_flags[c] == 0]
+        if not active:
+            break
+
+    results = {}
+    for coeff in coeffs:
+        count = counts[coeff]
+        if count[CONVERGED] + count[DEFERRED] == total:
+            results[coeff] = "All numbers converged"
+        else:
+            results[coeff] = f"Failed - {count[LOOP_DETECTED]} looped, {count[DIVERGED]} diverged, {count[OVERFLOW]} overflows, {count[ABANDONED]} abandoned, {count[ERROR]} error, {count[UNINITIALIZED_STATUS]} uninitialized, {count[DEFERRED]} deferred"
+
+        for minimum, count in sorted(cycle_hits[coeff].items()):
+            print(f'[C_{coeff}] {count} lanes fell into the cycle with minimal element {minimum}')
+
+    if any(cycle_hits.values()):
+        registry.save()
+
+    if witnesses is not None:
+        witnesses.save()
+
+    print(f'Sweep took {time.time() - t1} seconds.')
+
+    if 3 in results and results[3] != "All numbers converged":
+        raise Exception(f'Control failure: {results[3]}')
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sweep strong Collatz coefficients over a shared input stream.')
+    parser.add_argument('--min', type=int, default=MIN_COEFFICIENT)
+    parser.add_argument('--max', type=int, default=MAX_COEFFICIENT)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--registry', default=REGISTRY_PATH,
+        help='Where the known cycles are kept between runs.')
+    parser.add_argument('--witnesses', default='sweep.witnesses.npz',
+        help='Where to write a record of every lane that did not converge.')
+    args = parser.parse_args()
+
+    registry = CycleRegistry(args.registry)
+    registry.load()
+
+    witnesses = Witnesses(args.witnesses)
+
+    coeffs = list(range(args.min | 1, args.max + 1, 2))
+
+    random_test_results = sweep(coeffs, RANDOM_NUM_TESTS, DIVERGENCE_CAP, RANDOM_ELEMENT_MIN, RANDOM_ELEMENT_MAX, method='random', chunk_size=args.chunk_size, registry=registry, witnesses=witnesses)
+    random_sequence = [k for k,v in random_test_results.items() if v == 'All numbers converged']
+    print(f'Random Sequence Result: {random_sequence}')
+
+    # perform the serial tests on the first N integers
+    serial_test_results = sweep(random_sequence, SERIAL_NUM_TESTS, DIVERGENCE_CAP, 1, None, method='serial', chunk_size=args.chunk_size, registry=registry, witnesses=witnesses)
+    serial_sequence = [k for k,v in serial_test_results.items() if v == 'All numbers converged']
+    print(f'Serial Sequence Result: {serial_sequence}')
@@ -6,6 +6,10 @@ import random
 from numba import cuda, jit, uint8, uint32
 import sympy
 import time
+import cycles
+from checkpoint import Checkpoint
+from strip import bigint_engine, BIGINT_ENGINES, DEFAULT_BIGINT_ENGINE
+from stats import Stats, Trajectory
 
 
 primes = None
@@ -19,87 +23,145 @@ total_reductions = 0
 
 
 # Use this function to debug individual elements with arbitrary precision on the CPU
-def _collatz(coefficient, n, memo=None):
+#
+# The bit length is taken once per step and everything is counted in locals, the
+# totals only go out (to total_reductions and stats) when the trajectory is done.
+def _collatz(coefficient, n, memo=None, method=cycles.DEFAULT_DETECTOR, stats=None, engine=DEFAULT_BIGINT_ENGINE):
     global total_reductions
 
+    engine = bigint_engine(engine)
+    strip = engine.stripper(coefficient)
+    n = engine.convert(n)
+
     first_n = n
-    primes = list(sympy.sieve.primerange(coefficient))
-    last_double = int(n).bit_length()
-    largest_log = int(n).bit_length()
+    start_bits = n.bit_length()
+    last_double = start_bits
+    largest_log = start_bits
 
     did_double = 0
+    strip_steps = 0
+    multiplies = 0
+
+    # the next multiple of UPDATE_FREQUENCY total reductions to print at
+    next_update = (total_reductions // UPDATE_FREQUENCY + 1) * UPDATE_FREQUENCY
 
-    seen = []
+    def step(n):
+        # Remove primes smaller than coeff
+        return coefficient * strip(n)[0] + 1
+
+    detector = cycles.detector(step, n, method)
 
     #print(f'CPU Testing coefficient {coefficient} on element of size {last_log} bits.')
 
     while True:
-        seen.append(n)
-        
-        # Remove primes smaller than coeff
-        for p in primes:
-            
-            if p >= coefficient:
-                break
-
-            while n % p == 0:
-                n = n // p
-                total_reductions += 1
+        n, stripped = strip(n)
+        if stripped:
+            strip_steps += 1
 
         if n == 1:
             break
 
         n = coefficient * n + 1
-        total_reductions += 1
-        if total_reductions % UPDATE_FREQUENCY == 0:
-            print(f'{total_reductions} total reductions [current bits: {int(n).bit_length()}]')
-
-        if n in seen:
-            print(f'Loop detected from {first_n} reduced to {n}.')
+        multiplies += 1
+        reductions = total_reductions + strip_steps + multiplies
+        if reductions >= next_update:
+            print(f'{reductions} total reductions [current bits: {n.bit_length()}]')
+            next_update = (reductions // UPDATE_FREQUENCY + 1) * UPDATE_FREQUENCY
+
+        if detector.update(n):
+            cycle = cycles.locate(step, first_n, detector.length)
+            print(f'Loop detected from {first_n} reduced to {cycle.entry}, cycle length {cycle.length}.')
             raise Exception('LOOOOOOP')
-            break
 
-        if int(n).bit_length() > largest_log:    
-            #print(f'N increased in bits to {int(n).bit_length()}')
-            
-            if int(n).bit_length() >= last_double * 2: # x doubled in bits
-                print(f'N hit a new max in bits doublesL {did_double},  nbits: {int(n).bit_length()}')
+        bits = n.bit_length()
+        if bits > largest_log:
+            #print(f'N increased in bits to {bits}')
+
+            if bits >= last_double * 2: # x doubled in bits
+                print(f'N hit a new max in bits doublesL {did_double},  nbits: {bits}')
                 did_double += 1
-                last_double = int(n).bit_length()
+                last_double = bits
+
+                if did_double >= DOUBLE_LIMIT and bits > DOUBLE_LIMIT_NBITS:
+                    raise Exception(f'coefficient {coefficient} failed the Arbitrary precision CPU audit at {bits} bits')
 
-                if did_double >= DOUBLE_LIMIT and int(n).bit_length() > DOUBLE_LIMIT_NBITS:
-                    #raise Exception(f'coefficient {coefficient} failed the Arbitrary precision CPU audit ')
-                    import pdb;pdb.set_trace()
-                    raise Exception(f'coefficient {coefficient} failed the Arbitrary precision CPU audit at {int(n).bit_length()} bits')
+            largest_log = bits
+
+    total_reductions += strip_steps + multiplies
+    if stats is not None:
+        stats.record(coefficient, Trajectory(start_bits, strip_steps + multiplies, largest_log, strip_steps, multiplies))
 
-            largest_log = int(n).bit_length()
-        
     #print(f'Done at {n}. Largest number of bits in reduction: {largest_log}')
     return True
 
 # perform the random tests!
 if __name__ == "__main__":
     
-    COEFFICIENT = int(sys.argv[1])
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Audit a strong Collatz coefficient with arbitrary precision.')
+    parser.add_argument('coefficient', type=int)
+    parser.add_argument('--checkpoint', default=None,
+        help='Where to periodically save progress.')
+    parser.add_argument('--resume', action='store_true',
+        help='Continue from the last checkpoint instead of starting over.')
+    parser.add_argument('--stats', default=None,
+        help='Write per-trajectory histograms here as json.')
+    parser.add_argument('--engine', choices=list(BIGINT_ENGINES), default=DEFAULT_BIGINT_ENGINE,
+        help='Arbitrary precision engine to reduce with.')
+    args = parser.parse_args()
+
+    engine = bigint_engine(args.engine).name
+
+    stats = Stats()
+
+    COEFFICIENT = args.coefficient
     NUM_TESTS = 10000
     RANDOM_MIN = 2**2047
     RANDOM_MAX = 2**2048-1
+
+    checkpoint_path = args.checkpoint or f'test_25_cpu.C{COEFFICIENT}.checkpoint.json'
+    checkpoint = Checkpoint(checkpoint_path)
+    if args.resume and checkpoint.load():
+        print(f'Resuming from {checkpoint_path}')
+        checkpoint.restore_rng()
+
+    entry = checkpoint.coefficient(COEFFICIENT)
+    total_reductions = entry['counts'].get('reductions', 0)
+    random_start = entry['counts'].get('random', 0)
+
     try:
         # serial test
         print(f'Serial tests...')
-        for i in range(1 , NUM_TESTS):
-            result = _collatz(COEFFICIENT, i)
+        for i in range(entry['next'], NUM_TESTS):
+            result = _collatz(COEFFICIENT, i, stats=stats, engine=engine)
+            checkpoint.update(COEFFICIENT, i + 1, {'random': 0, 'reductions': total_reductions})
+            checkpoint.save_if_due()
             #print(f'{i} ', end='', flush=True)
     
         print(f'Random tests...')
-        for i in range(NUM_TESTS):
+        for i in range(random_start, NUM_TESTS):
+            # saved before the draw, so a resumed run reduces the same N
+            checkpoint.store_rng()
+            checkpoint.update(COEFFICIENT, NUM_TESTS, {'random': i, 'reductions': total_reductions})
+            checkpoint.save_if_due()
+
             N = random.randint(RANDOM_MIN, RANDOM_MAX)
-            result = _collatz(COEFFICIENT, N)
+            result = _collatz(COEFFICIENT, N, stats=stats, engine=engine)
             print(f'{i} ', end='', flush=True)
-    except KeyboardInterrupt as exc:
-        import pdb;pdb.set_trace()
-        raise exc
+    except KeyboardInterrupt:
+        checkpoint.save()
+        if args.stats:
+            stats.save(args.stats)
+        print(f'\nInterrupted, progress saved to {checkpoint_path}. Rerun with --resume to continue.')
+        sys.exit(1)
+
+    checkpoint.update(COEFFICIENT, NUM_TESTS, {'random': NUM_TESTS, 'reductions': total_reductions})
+    checkpoint.finish(COEFFICIENT, True)
+    checkpoint.save()
 
     print(f'\nDone. Total reductions: {total_reductions} ({int(math.log(total_reductions, 2))})')
-    import pdb;pdb.set_trace()
-    sys.exit(1)
+    stats.summary()
+    if args.stats:
+        stats.save(args.stats)
+    sys.exit(0)
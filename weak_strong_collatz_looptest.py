@@ -1,11 +1,14 @@
 import sys
+import time
 import numpy as np
 import math
 import pprint
 import random
 from numba import cuda
 import sympy
-from numba import int64, uint32, vectorize, void
+from collections import namedtuple
+from numba import int64, uint32, uint64, vectorize, void, njit
+from wide import mul128_64, add128_64, shr128, gt128, from_limbs
 
 primes = None
 
@@ -113,80 +116,6 @@ def collatz_weak_cuda(n_arr, coeff, divergence_limit, results, status_flag, daig
         raise Exception()
 
 
-#@vectorize([void(int64, int64, int64, int64[:], int64, int64[:], int64[:])])
-@cuda.jit
-def collatz_single_reduce(coeff, orig_n, divergence_limit, results, status_flag, daignostic_arr, full_calculation_array):
-    num_computations = int64(0)
-    idx = cuda.grid(1)
-    
-    turtle = int64(orig_n)
-    hare = int64(orig_n)
-    full_calculation_array[num_computations] = turtle
-
-    # calculate the result
-    while True:
-
-        turtle = collatz_weak_reduce(turtle, int64(coeff), int64(divergence_limit))
-        hare = collatz_weak_reduce(hare, int64(coeff), int64(divergence_limit))
-        hare = collatz_weak_reduce(hare, int64(coeff), int64(divergence_limit))
-        
-        num_computations = int64(num_computations + 1)
-        full_calculation_array[num_computations] = turtle
-
-        #if status1 == CONVERGED or status2 == CONVERGED:
-        #    result = CONVERGED  # Converged
-        #    print('CONVERGED', orig_n, turtle, hare)
-        #    break 
-        
-        #if status1 == DIVERGED or status2 == DIVERGED:
-        #    result = DIVERGED
-        #    print('DIVERGED', orig_n, turtle, hare)
-        #    break
-
-        #if status1 == OVERFLOW or status2 == OVERFLOW:
-        #    result = OVERFLOW
-        #    print('OVERFLOW', orig_n, turtle, hare)
-        #    break
-        
-        if turtle == hare: # loop detected
-            result = LOOP_DETECTED
-            status_flag[0] = STATUS_STOP # only stop if a loop is found
-            print('LOOP DETECTED', orig_n, turtle, hare)
-            break
-        
-        if status_flag[0] != 0:
-            result = ABANDONED
-            break
-
-    results[idx] = result
-    daignostic_arr[idx] = num_computations
-    return
-
-
-@cuda.jit
-def test_array_for_loop(test_arr, arr_size):
-    idx = cuda.grid(1)
-
-    if idx != 0:
-        return
-    
-    start = test_arr[0]
-
-    i = int64(1)
-
-    while True:
-        if test_arr[i] == start:
-            print('CONFIRMED!', i, test_arr[i], start)
-            break
-        elif i > arr_size:
-            print('Nope...')
-            break
-        else:
-            i = int64(i + 1)
-            continue
-
-    return
-
 def test_coefficients_gpu(test_size, divergence_limit, ele_min, ele_max, method=None):
 
     results = {}
@@ -285,34 +214,100 @@ def _collatz(coefficient, number_to_reduce, print_frequency=100000, expected_cal
 
     return 
 
-def cuda_single(coeff, n, test_size=10000, expected_loop_size=7000000):
-    results = {}
-    threads_per_block = 1024
-
-    # array of test elements
-    n_arr = np.full(test_size+1, 0, dtype=np.uint64)
-
-    # where we will store the result of each calculation
-    result_arr = np.full(test_size+1, UNINITIALIZED, dtype=np.uint32)
-    
-    # where interesting info about the results, such as the size of a loop, will be found
-    daignostic_arr = np.full(test_size+1, UNINITIALIZED, dtype=np.uint32)
-
-    full_calculation_array = np.full(expected_loop_size, UNINITIALIZED, dtype=np.uint64)
-    
-    # an array of a single element, to check to abandon processing
-    status_flag = np.full(1, 0)
-
-    blocks_per_grid = math.ceil(n_arr.size / threads_per_block)
-    collatz_single_reduce[1, 1](coeff, n, DIVERGENCE_CAP, result_arr, status_flag, daignostic_arr, full_calculation_array)
-
-    test_array_for_loop[blocks_per_grid, threads_per_block](full_calculation_array, expected_loop_size)
-
-    return full_calculation_array
-
-fulle_calc_array = cuda_single(7, 21609356070111456)
-returnval = _collatz(7, 21609356070111456, expected_calcs=6224043, compare_array=fulle_calc_array); import pdb;pdb.set_trace(); sys.exit(0)
-
+# the weak map's step limit before weak_cycle gives up looking for a cycle
+WEAK_STEP_LIMIT = 2**40
+
+# tail: steps from the start to the first cycle element it reaches
+# length: the number of elements in the cycle
+# minimum: the cycle's smallest element
+# peak: the largest value on the way, tail and cycle both
+WeakCycle = namedtuple('WeakCycle', ['tail', 'length', 'minimum', 'peak'])
+
+
+# one step of the weak map, n/2 or coeff*n + 1, on a 128-bit (hi, lo) value;
+# returns the result and whether it overflowed
+@njit(nogil=True, inline='always')
+def weak_step128(hi, lo, coeff):
+    if lo & uint64(1) == 0:
+        hi, lo = shr128(hi, lo, 1)
+        return hi, lo, False
+    hi, lo, overflow = mul128_64(hi, lo, coeff)
+    hi, lo, carry = add128_64(hi, lo, 1)
+    return hi, lo, overflow or carry
+
+
+# Characterize the cycle the weak C_coeff trajectory of (n_hi, n_lo) falls into,
+# in constant memory. Brent's algorithm finds the cycle length, and its hare walks
+# the whole tail and cycle on the way, which gives the peak. A second pass with the
+# hare a cycle ahead finds the tail, and one lap of the cycle finds its minimum.
+# Returns (status, tail, length, min_hi, min_lo, peak_hi, peak_lo); the status is
+# LOOP_DETECTED, OVERFLOW past 128 bits, or CONTINUE past max_steps, and for the
+# last two tail is the number of steps taken.
+@njit(nogil=True)
+def weak_cycle_cpu(n_hi, n_lo, coeff, max_steps):
+    coeff = uint64(coeff)
+    zero = uint64(0)
+    peak_hi, peak_lo = n_hi, n_lo
+
+    t_hi, t_lo = n_hi, n_lo
+    h_hi, h_lo, overflow = weak_step128(n_hi, n_lo, coeff)
+    power = 1
+    length = 1
+    steps = 1
+    while h_hi != t_hi or h_lo != t_lo:
+        if overflow:
+            return OVERFLOW, steps, 0, zero, zero, peak_hi, peak_lo
+        if gt128(h_hi, h_lo, peak_hi, peak_lo):
+            peak_hi, peak_lo = h_hi, h_lo
+        if steps >= max_steps:
+            return CONTINUE, steps, 0, zero, zero, peak_hi, peak_lo
+        if power == length:
+            t_hi, t_lo = h_hi, h_lo
+            power *= 2
+            length = 0
+        h_hi, h_lo, overflow = weak_step128(h_hi, h_lo, coeff)
+        length += 1
+        steps += 1
+
+    # every value from here on was seen above, so none of them overflow
+    t_hi, t_lo = n_hi, n_lo
+    h_hi, h_lo = n_hi, n_lo
+    for _ in range(length):
+        h_hi, h_lo, overflow = weak_step128(h_hi, h_lo, coeff)
+    tail = 0
+    while h_hi != t_hi or h_lo != t_lo:
+        t_hi, t_lo, overflow = weak_step128(t_hi, t_lo, coeff)
+        h_hi, h_lo, overflow = weak_step128(h_hi, h_lo, coeff)
+        tail += 1
+
+    min_hi, min_lo = t_hi, t_lo
+    for _ in range(length - 1):
+        t_hi, t_lo, overflow = weak_step128(t_hi, t_lo, coeff)
+        if gt128(min_hi, min_lo, t_hi, t_lo):
+            min_hi, min_lo = t_hi, t_lo
+
+    return LOOP_DETECTED, tail, length, min_hi, min_lo, peak_hi, peak_lo
+
+
+# weak_cycle_cpu for a Python int n below 2^128
+def weak_cycle(coeff, n, max_steps=WEAK_STEP_LIMIT):
+    status, tail, length, min_hi, min_lo, peak_hi, peak_lo = weak_cycle_cpu(uint64(n >> 64), uint64(n & (2**64 - 1)), uint64(coeff), max_steps)
+    if status == OVERFLOW:
+        raise Exception(f'[C_{coeff}] the weak trajectory of {n} overflowed 128 bits after {tail} steps')
+    if status == CONTINUE:
+        raise Exception(f'[C_{coeff}] no cycle within {max_steps} steps of {n}')
+    return WeakCycle(tail, length, from_limbs(0, min_hi, min_lo), from_limbs(0, peak_hi, peak_lo))
+
+# The 64-bit kernels saw a cycle of about 6.2M steps from here, but their products
+# wrapped: in exact arithmetic the trajectory grows without bound.
+t1 = time.time()
+try:
+    weak = weak_cycle(7, 21609356070111456)
+    print(f'[C_7] 21609356070111456 reaches a cycle of length {weak.length} after {weak.tail} steps, minimal element {weak.minimum}, peak {weak.peak} [2^{weak.peak.bit_length()}]')
+except Exception as e:
+    print(e)
+print(f'took {time.time() - t1:.2f} seconds')
+sys.exit(0)
 
 # the cap to stop evaluating due to explosion
 
@@ -0,0 +1,140 @@
+from numba import njit, uint64
+
+
+# Fixed-width unsigned arithmetic wider than 64 bits for the compiled kernels.
+# A 128-bit value is a (hi, lo) pair of uint64 limbs.
+
+MASK32 = uint64(0xffffffff)
+
+
+# full 64 x 64 -> 128 bit product, done in 32-bit halves
+@njit(nogil=True, inline='always')
+def mul64(a, b):
+    a = uint64(a)
+    b = uint64(b)
+
+    a_lo = a & MASK32
+    a_hi = a >> uint64(32)
+    b_lo = b & MASK32
+    b_hi = b >> uint64(32)
+
+    lo_lo = a_lo * b_lo
+    hi_lo = a_hi * b_lo
+    lo_hi = a_lo * b_hi
+    hi_hi = a_hi * b_hi
+
+    cross = (lo_lo >> uint64(32)) + (hi_lo & MASK32) + lo_hi
+    lo = (cross << uint64(32)) | (lo_lo & MASK32)
+    hi = hi_hi + (hi_lo >> uint64(32)) + (cross >> uint64(32))
+    return hi, lo
+
+
+# (hi, lo) + b, returns the sum and whether it carried out of 128 bits
+@njit(nogil=True, inline='always')
+def add128_64(hi, lo, b):
+    new_lo = lo + uint64(b)
+    carry = uint64(1) if new_lo < lo else uint64(0)
+    new_hi = hi + carry
+    return new_hi, new_lo, new_hi < hi
+
+
+# (hi, lo) * m for a 64-bit m, returns the product and whether it overflowed
+@njit(nogil=True, inline='always')
+def mul128_64(hi, lo, m):
+    carry, new_lo = mul64(lo, m)
+    top, new_hi = mul64(hi, m)
+    new_hi2 = new_hi + carry
+    overflow = top != 0 or new_hi2 < new_hi
+    return new_hi2, new_lo, overflow
+
+
+# (hi, lo) >> s for 0 < s < 64
+@njit(nogil=True, inline='always')
+def shr128(hi, lo, s):
+    s = uint64(s)
+    return hi >> s, (lo >> s) | (hi << (uint64(64) - s))
+
+
+@njit(nogil=True, inline='always')
+def gt128(a_hi, a_lo, b_hi, b_lo):
+    if a_hi != b_hi:
+        return a_hi > b_hi
+    return a_lo > b_lo
+
+
+# 192-bit values are (hi, mid, lo) triples of uint64 limbs.
+
+# (a2, a1, a0) * m + c for 64-bit m and c, returns the result and whether it
+# overflowed 192 bits
+@njit(nogil=True, inline='always')
+def muladd192(a2, a1, a0, m, c):
+    h0, r0 = mul64(a0, m)
+    h1, l1 = mul64(a1, m)
+    h2, l2 = mul64(a2, m)
+
+    s0 = r0 + uint64(c)
+    k0 = uint64(1) if s0 < r0 else uint64(0)
+
+    s1 = l1 + h0
+    k1 = uint64(1) if s1 < l1 else uint64(0)
+    t1 = s1 + k0
+    k1 += uint64(1) if t1 < s1 else uint64(0)
+
+    s2 = l2 + h1
+    k2 = s2 < l2
+    t2 = s2 + k1
+    k2 = k2 or t2 < s2
+
+    return t2, t1, s0, h2 != 0 or k2
+
+
+# A value congruent to (a2, a1, a0) mod m, for m < 2^16. weights[k] is 2^(32k) mod m
+# for the six 32-bit digits, so every term is below 2^48 and the sum can't overflow.
+# That leaves a 64-bit value, which the StripTable multiply-by-inverse test can check
+# for divisibility without dividing.
+@njit(nogil=True, inline='always')
+def fold192(a2, a1, a0, weights):
+    return ((a0 & MASK32) * weights[0] + (a0 >> uint64(32)) * weights[1]
+        + (a1 & MASK32) * weights[2] + (a1 >> uint64(32)) * weights[3]
+        + (a2 & MASK32) * weights[4] + (a2 >> uint64(32)) * weights[5])
+
+
+# the low 192 bits of (a2, a1, a0) * (b2, b1, b0), for exact division by an odd
+# number through its inverse mod 2^192
+@njit(nogil=True, inline='always')
+def mul192_lo(a2, a1, a0, b2, b1, b0):
+    h00, r0 = mul64(a0, b0)
+    h01, l01 = mul64(a0, b1)
+    h10, l10 = mul64(a1, b0)
+
+    r1 = h00 + l01
+    c1 = uint64(1) if r1 < h00 else uint64(0)
+    t1 = r1 + l10
+    c1 += uint64(1) if t1 < r1 else uint64(0)
+
+    r2 = h01 + h10 + c1 + a0 * b2 + a1 * b1 + a2 * b0
+    return r2, t1, r0
+
+
+# (a2, a1, a0) >> 1
+@njit(nogil=True, inline='always')
+def shr192_1(a2, a1, a0):
+    return a2 >> uint64(1), (a1 >> uint64(1)) | (a2 << uint64(63)), (a0 >> uint64(1)) | (a1 << uint64(63))
+
+
+@njit(nogil=True, inline='always')
+def gt192(a2, a1, a0, b2, b1, b0):
+    if a2 != b2:
+        return a2 > b2
+    if a1 != b1:
+        return a1 > b1
+    return a0 > b0
+
+
+# split a Python int below 2^192 into limbs, and join them back
+def to_limbs(n):
+    return (n >> 128) & (2**64 - 1), (n >> 64) & (2**64 - 1), n & (2**64 - 1)
+
+
+def from_limbs(a2, a1, a0):
+    return (int(a2) << 128) | (int(a1) << 64) | int(a0)
@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+from wide import to_limbs, from_limbs
+
+
+# where the batch engines keep their witness records between runs
+WITNESS_PATH = 'cuda.witnesses.npz'
+
+# records kept per run; the counts still cover every lane past this
+WITNESS_LIMIT = 2**16
+
+# the widest kernel's limbs (cuda.LIMBS), values are stored that wide
+LIMBS = 3
+
+# the status codes that aren't worth a record: converged, abandoned because
+# another lane failed first, and deferred to a smaller integer of the same run
+CONVERGED = 1
+ABANDONED = 4
+DEFERRED = 7
+
+
+# One record per lane that didn't converge, so a failure can be looked into without
+# running anything again. Integers are uint64 limbs, lowest first.
+#
+# index: the lane's position in the run (integer ele_min + index for serial runs)
+# start: the integer the lane started from
+# status: the status code it ended with
+# steps: steps of the strong map from start to value
+# peak_bits: bit length of the largest value the lane reached, which for a lane
+#   carried on past the kernel or a hare that ran ahead can be past value
+# value: where the lane stopped. A member of the cycle for a loop, the first value
+#   past the divergence limit, and for an overflow the last value the kernel held.
+#   An overflow under a divergence limit the kernel holds is counted as diverged,
+#   but its record keeps the overflow status and value. Lanes carried on past the
+#   kernel (see escalation.py) get the value where they ended up instead, if it
+#   fits.
+# cycle: minimal element of the known cycle it fell into, 0 if none
+WITNESS_DTYPE = np.dtype([
+    ('index', np.uint64),
+    ('start', np.uint64, (LIMBS,)),
+    ('status', np.uint8),
+    ('steps', np.uint64),
+    ('peak_bits', np.uint16),
+    ('value', np.uint64, (LIMBS,)),
+    ('cycle', np.uint64),
+])
+
+
+# a record's integers, lowest limb first
+def record_int(limbs):
+    return from_limbs(*limbs[::-1])
+
+
+# lane arrays are 1D for the 64-bit kernels and (lanes, limbs) for the wide one
+def limb_columns(arr):
+    out = np.zeros((arr.shape[0], LIMBS), dtype=np.uint64)
+    if arr.ndim == 1:
+        out[:, 0] = arr
+    else:
+        out[:, :arr.shape[1]] = arr
+    return out
+
+
+# Witness records per run, keyed like the checkpoint (method-coefficient), kept in
+# a single npz with one structured array per key.
+class Witnesses:
+
+    def __init__(self, path=WITNESS_PATH, limit=WITNESS_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.records = {}
+
+    # returns False when there is nothing to load
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as saved:
+            self.records = {key: saved[key] for key in saved.files}
+        return True
+
+    # write to a temporary file and swap it in, like Checkpoint.save
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        return self.records.get(key, np.zeros(0, dtype=WITNESS_DTYPE))
+
+    # forget a key's records, for a run that starts over
+    def reset(self, key):
+        self.records.pop(key, None)
+
+    # Record the lanes of a chunk that didn't converge. lo is the position of the
+    # chunk's first lane in the run, the other arrays are what the kernel wrote.
+    def add(self, key, lo, n_arr, result_arr, hits, values, steps, peaks):
+        records = self.get(key)
+        room = self.limit - records.size
+        if room <= 0:
+            return
+
+        idx = np.flatnonzero((result_arr != CONVERGED) & (result_arr != ABANDONED) & (result_arr != DEFERRED))[:room]
+        if idx.size == 0:
+            return
+
+        new = np.zeros(idx.size, dtype=WITNESS_DTYPE)
+        new['index'] = lo + idx
+        new['start'] = limb_columns(n_arr[idx])
+        new['status'] = result_arr[idx]
+        new['steps'] = steps[idx]
+        new['value'] = limb_columns(values[idx])
+        new['cycle'] = hits[idx]
+
+        # the value is past the peak for a divergence
+        peak_limbs = limb_columns(peaks[idx])
+        for i in range(idx.size):
+            new['peak_bits'][i] = max(record_int(peak_limbs[i]).bit_length(), record_int(new['value'][i]).bit_length())
+
+        self.records[key] = np.concatenate([records, new])
+
+    # Update the record of a lane that was carried on past the kernel (see
+    # escalation.py) with where it ended up.
+    def update(self, key, index, status, steps, peak_bits, value, cycle=0):
+        records = self.records.get(key)
+        if records is None:
+            return
+        i = np.flatnonzero(records['index'] == index)
+        if i.size == 0:
+            return
+
+        j = i[0]
+        records['status'][j] = status
+        records['peak_bits'][j] = max(int(records['peak_bits'][j]), peak_bits)
+        records['cycle'][j] = cycle
+        # otherwise the record keeps the value (and steps) the kernel handed over
+        if value.bit_length() <= 64 * LIMBS:
+            records['value'][j] = to_limbs(value)[::-1]
+            records['steps'][j] = steps